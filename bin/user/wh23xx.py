@@ -246,25 +246,71 @@ Command Result
     9 RT_INVALID_PARAM
 """
 
+from __future__ import print_function
 from __future__ import with_statement
+import array
+import bisect
+import collections
+import gc
+import itertools
+import json
+import math
+import os
+import random
+import struct
+import sys
 import syslog
+import threading
 import time
+import zlib
 import usb
+try:
+    # pyusb 1.x, which also provides the legacy 0.4 interface
+    import usb.core
+    import usb.util
+except ImportError:
+    pass
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import weewx.drivers
-from weeutil.weeutil import timestamp_to_string, log_traceback
+from weeutil.weeutil import timestamp_to_string, log_traceback, to_bool
 from weewx.wxformulas import calculate_rain
 
 DRIVER_NAME = 'WH23xx'
-DRIVER_VERSION = '0.14'
+DRIVER_VERSION = '0.15'
 
 def loader(config_dict, _):
-    return WH23xxDriver(**config_dict[DRIVER_NAME])
+    stn_dict = dict(config_dict[DRIVER_NAME])
+    if 'history_cursor' not in stn_dict:
+        stn_dict['history_cursor'] = _get_state_path(
+            config_dict, 'wh23xx-history.cursor')
+    if 'device_cache' not in stn_dict:
+        stn_dict['device_cache'] = _get_state_path(
+            config_dict, 'wh23xx-device.cache')
+    if 'stations' in stn_dict:
+        return WH23xxMultiDriver(**stn_dict)
+    return WH23xxDriver(**stn_dict)
 
 def confeditor_loader():
     return WH23xxConfigurationEditor()
 
 
+def _get_state_path(config_dict, filename):
+    # by default the history cursor and the device cache live next to the
+    # sqlite databases
+    try:
+        return os.path.join(
+            config_dict['WEEWX_ROOT'],
+            config_dict['DatabaseTypes']['SQLite']['SQLITE_ROOT'],
+            filename)
+    except KeyError:
+        return None
+
+
 def logmsg(level, msg):
     syslog.syslog(level, 'wh23xx: %s' % msg)
 
@@ -277,9 +323,19 @@ def loginf(msg):
 def logerr(msg):
     logmsg(syslog.LOG_ERR, msg)
 
+def _debug_enabled():
+    # setlogmask(0) returns the current mask without changing it.  use this
+    # to avoid formatting debug messages that syslog would discard anyway.
+    return syslog.setlogmask(0) & syslog.LOG_MASK(syslog.LOG_DEBUG)
+
 
 LUMINOSITY_TO_RADIATION = 0.0079
 
+# python 2 has no monotonic clock, so fall back to the system clock
+_monotonic = getattr(time, 'monotonic', time.time)
+# the best timer for measuring short intervals
+_perf_counter = getattr(time, 'perf_counter', time.time)
+
 
 #' '.join(["%0.2X" % ord(c) for c in buf]))
 def _fmt(buf):
@@ -296,18 +352,20 @@ def _calc_checksum(a):
 def _get_bit(x, bit):
     return 1 if ((x & (1 << bit)) == (1 << bit)) else 0
 
-def _decode_bytes(buf, idx, nbytes, func):
-    # if all bytes are 0xff, the value is not valid...
-    for j in range(nbytes):
-        if buf[idx + j] != 0xff:
-            break
-    else:
-        return None
-    # ...otherwise, calculate a value from the bytes, MSB first
-    x = 0
-    for j in range(nbytes):
-        x += buf[idx + j] << ((nbytes - j - 1) * 8)
-    return func(x)
+def _compile_item_mapping(mapping, bogus=None):
+    # compile the item mapping into a table that can be indexed directly by
+    # the item identifier (without the date and time bits).  each entry is
+    # (label, num_bytes, unpack, invalid_values, divisor, offset).
+    formats = {1: 'B', 2: '>H', 4: '>I'}
+    table = [None] * 0x40
+    for item in mapping:
+        label, nbytes, divisor, offset = mapping[item]
+        invalid = [(1 << (8 * nbytes)) - 1]
+        if bogus and item in bogus:
+            invalid.append(bogus[item])
+        table[item] = (label, nbytes, struct.Struct(formats[nbytes]).unpack_from,
+                       frozenset(invalid), divisor, offset)
+    return table
 
 def _signed(x):
     v = x & 0xf
@@ -315,7 +373,13 @@ def _signed(x):
         v *= -1
     return v
 
+# upper bound of each uv index, used for vectorized uv-to-uvi conversion
+UV_THRESHOLDS = [99, 540, 1000, 1400, 1843, 2292, 2734, 3138, 3648, 4196,
+                 4707, 5209, 5735, 6276, 6778, 20000]
+
 def _uv_to_uvi(x):
+    if x is None:
+        return None
     if x < 99:
         return 0
     elif x < 540:
@@ -388,96 +452,1340 @@ class WH23xxConfigurationEditor(weewx.drivers.AbstractConfEditor):
 
     # The driver to use
     driver = user.wh23xx
+
+    # To change which decoded values end up in which database fields, use
+    # a sensor_map to replace the default map, or sensor_map_extensions to
+    # add to it.  For example:
+    #
+    # [[sensor_map_extensions]]
+    #     extraTemp1 = windchill
+
+    # How often to poll the station, in seconds.  With poll_mode = adaptive
+    # the interval moves between poll_interval_min and poll_interval_max,
+    # polling fast while the gust speed is over gust_threshold (m/s) or it
+    # is raining.
+    poll_interval = 15
+
+    # If there is more than one station, pick one by usb bus and address,
+    # or by station id.  To read from several stations, see the
+    # documentation for WH23xxMultiDriver.
+    # station_id = 0xbc7a2828
+
+    # The usb interface: core for pyusb 1.x, legacy for pyusb 0.4, or auto
+    # to use core if it is available.
+    # transport = auto
+
+    # To export metrics for prometheus, specify a port for http and/or a
+    # file for the node exporter textfile collector.
+    # metrics_port = 9523
+    # metrics_textfile = /var/lib/node_exporter/wh23xx.prom
+
+    # To share the data with other local programs, such as the driver in
+    # client mode (--socket), publish it on a unix socket.
+    # publish_socket = /var/run/wh23xx.sock
+
+    # To record every reply from the station for later replay, specify a
+    # capture file.  The file is compressed if the name ends with .gz.
+    # capture_file = /var/tmp/wh23xx.cap
 """
 
 
 class WH23xxDriver(weewx.drivers.AbstractDevice):
-    def __init__(self, **stn_dict):
+    # number of history records to read each time we take the station lock
+    HISTORY_BATCH_SIZE = 64
+
+    # map from weewx field name to the label of a decoded item.  the rain
+    # field is calculated as the difference between successive values of
+    # the mapped rain counter.
+    DEFAULT_SENSOR_MAP = {
+        'windDir': 'wind_dir',
+        'windSpeed': 'wind_speed',
+        'windGust': 'gust_speed',
+        'inHumidity': 'in_humidity',
+        'outHumidity': 'out_humidity',
+        'inTemp': 'in_temp',
+        'outTemp': 'out_temp',
+        'dewpoint': 'dewpoint',
+        'windchill': 'windchill',
+        'heatindex': 'heatindex',
+        'pressure': 'abs_baro',
+        'barometer': 'rel_baro',
+        'luminosity': 'light',
+        'uv_raw': 'uv',
+        'UV': 'uvi',
+        'rain': 'rain_totals',
+        'rainRate': 'rain_rate',
+        'stormRain': 'rain_event',
+        'hourRain': 'rain_hour',
+        'dayRain': 'rain_day',
+        'weekRain': 'rain_week',
+        'monthRain': 'rain_month',
+        'yearRain': 'rain_year',
+        }
+
+    def __init__(self, station=None, **stn_dict):
+        # the station is normally found on usb, but another may be provided,
+        # for example one that uses a WH23xxSimulator.
         loginf('driver version is %s' % DRIVER_VERSION)
         loginf('usb info: %s' % get_usb_info())
         self._model = stn_dict.get('model', 'Tycon TP2700')
-        self._poll_interval = int(stn_dict.get('poll_interval', 15))
+        self._poll_interval = float(stn_dict.get('poll_interval', 15))
         loginf('poll interval is %s' % self._poll_interval)
         self.max_tries = int(stn_dict.get('max_tries', 5))
         self.retry_wait = int(stn_dict.get('retry_wait', 10))
         self._debug_rain = int(stn_dict.get('debug_rain', 0))
         self.last_rain = None
-        self._station = WH23xxStation()
+        sensor_map = dict(stn_dict.get('sensor_map', self.DEFAULT_SENSOR_MAP))
+        if 'sensor_map_extensions' in stn_dict:
+            sensor_map.update(stn_dict['sensor_map_extensions'])
+        loginf('sensor map is %s' % sensor_map)
+        self._sensor_map, self._rain_item = self._compile_sensor_map(sensor_map)
+        self._archive_interval = None
+        self._scheduler = None
+        # poll at a fixed interval, or adapt the interval to the weather
+        self._adaptive = None
+        if stn_dict.get('poll_mode', 'fixed') == 'adaptive':
+            self._adaptive = WH23xxAdaptivePoller(
+                float(stn_dict.get('poll_interval_min', 2)),
+                float(stn_dict.get('poll_interval_max', 60)),
+                float(stn_dict.get('gust_threshold', 8.0)),
+                float(stn_dict.get('rain_rate_threshold', 0.0)),
+                float(stn_dict.get('burst_hold', 120)))
+            self._poll_interval = self._adaptive.interval
+            loginf('adaptive polling from %s to %s' %
+                   (self._adaptive.min_interval, self._adaptive.max_interval))
+        # read from the station in the weewx thread (inline), or in a
+        # separate thread that queues the data (thread)
+        self._acquisition = stn_dict.get('acquisition', 'inline')
+        self._queue_size = int(stn_dict.get('queue_size', 10))
+        self._queue_overflow = stn_dict.get('queue_overflow', 'drop-oldest')
+        loginf('acquisition is %s' % self._acquisition)
+        if self._acquisition == 'thread':
+            loginf('queue size is %s, overflow policy is %s' %
+                   (self._queue_size, self._queue_overflow))
+        self._reader = None
+        self._station_lock = threading.Lock()
+        # what to do with a frame that is identical to the previous frame:
+        # emit a packet using the previous decoded data, or skip it.  with
+        # delta packets, a packet contains only the fields that changed.
+        self._duplicate_frames = stn_dict.get('duplicate_frames', 'emit')
+        self._delta_packets = to_bool(stn_dict.get('delta_packets', False))
+        loginf('duplicate frames: %s, delta packets: %s' %
+               (self._duplicate_frames, self._delta_packets))
+        self._last_raw = None
+        self._last_decoded = None
+        self.frames_read = 0
+        self.frames_duplicate = 0
+        self._cursor_file = stn_dict.get('history_cursor')
+        loginf('history cursor is %s' % self._cursor_file)
+        self._station = station or WH23xxStation(
+            bus=stn_dict.get('bus'), address=stn_dict.get('address'),
+            station_id=stn_dict.get('station_id'),
+            transport=stn_dict.get('transport', 'auto'),
+            device_cache=stn_dict.get('device_cache'))
+        loginf('usb transport is %s' % self._station.transport.name)
+        if stn_dict.get('capture_file'):
+            self._station.capture = WH23xxCapture(stn_dict['capture_file'])
         self._station.open()
+        # optionally share what we read with other local processes
+        self._publisher = None
+        if stn_dict.get('publish_socket'):
+            self._publisher = WH23xxPublisher(stn_dict['publish_socket'])
+            self._publisher.start()
+        # optionally export metrics for prometheus, over http and/or to a
+        # file for the node exporter textfile collector
+        self._exporter = None
+        port = stn_dict.get('metrics_port')
+        textfile = stn_dict.get('metrics_textfile')
+        if port or textfile:
+            self._exporter = WH23xxMetricsExporter(
+                self.get_stats, textfile=textfile,
+                address=stn_dict.get('metrics_address', '127.0.0.1'),
+                port=int(port) if port else None,
+                interval=float(stn_dict.get('metrics_interval', 15)))
+            self._exporter.start()
 
     def closePort(self):
+        if self._exporter is not None:
+            self._exporter.stop()
+            self._exporter = None
+        if self._reader is not None:
+            self._reader.stop()
+            self._reader = None
+        if self._publisher is not None:
+            self._publisher.stop()
+            self._publisher = None
         self._station.close()
+        if self._station.capture is not None:
+            self._station.capture.close()
+            self._station.capture = None
 
     @property
     def hardware_name(self):
         return self._model
 
     def genLoopPackets(self):
+        if self._acquisition == 'thread':
+            frames = self._gen_frames_threaded()
+        else:
+            frames = self._gen_frames_inline()
+        last = None
+        for ts, decoded in frames:
+            changed = None
+            if self._delta_packets and last is not None:
+                changed = decoded.get_changed_items(last)
+            last = decoded
+            t0 = _perf_counter()
+            packet = self._data_to_packet(decoded, ts, changed)
+            self._station.stats.observe('packet', _perf_counter() - t0)
+            if _debug_enabled():
+                logdbg("packet: %s" % packet)
+            if self._publisher is not None:
+                self._publisher.publish_packet(packet)
+            yield packet
+
+    def _gen_frames_inline(self):
+        # read from the station then wait for the next poll
+        scheduler = WH23xxPollScheduler(self._poll_interval)
+        self._scheduler = scheduler
         while True:
-            raw = self._get_current()
-            logdbg("raw data: %s" % raw)
-            if raw:
-                try:
-                    decoded = WH23xxStation.decode_weather_data(raw)
+            frame = self._poll()
+            if frame:
+                yield frame
+            scheduler.wait()
+
+    def _gen_frames_threaded(self):
+        # a separate thread reads from the station, so all we do is wait for
+        # whatever it has queued.
+        if self._reader is None:
+            self.start_reader()
+        while True:
+            yield self._reader.get()
+
+    def start_reader(self, poll=None, queue=None, name='wh23xx-reader'):
+        # start a thread that polls the station and queues what it reads.
+        # by default it has its own queue and polls with _poll.
+        self._reader = WH23xxReader(
+            poll or self._poll, self._poll_interval,
+            self._queue_size, self._queue_overflow, queue=queue, name=name)
+        self._scheduler = self._reader.scheduler
+        self._reader.start()
+        return self._reader
+
+    @property
+    def delta_packets(self):
+        return self._delta_packets
+
+    def _poll(self):
+        # read and decode the current data.  return (timestamp, decoded)
+        # or None if there was nothing to decode.  the station updates its
+        # data only every few seconds, so if the frame is the same as the
+        # last one, either reuse the last decoded data or skip it.
+        raw = self._get_current()
+        ts = time.time()
+        debug = _debug_enabled()
+        if debug:
+            logdbg("raw data: %s" % _fmt(raw))
+        if raw:
+            self.frames_read += 1
+            if self._publisher is not None:
+                self._publisher.publish_frame(ts, raw)
+            if raw == self._last_raw:
+                self.frames_duplicate += 1
+                self._adapt_interval(self._last_decoded, False)
+                if self._duplicate_frames == 'skip':
+                    logdbg("skipping duplicate frame")
+                    return None
+                return ts, self._last_decoded
+            try:
+                t0 = _perf_counter()
+                decoded = WH23xxStation.decode_weather_record(raw)
+                self._station.stats.observe('decode', _perf_counter() - t0)
+                if debug:
                     logdbg("decoded data: %s" % decoded)
-                    if decoded:
-                        packet = self._data_to_packet(decoded)
-                        logdbg("packet: %s" % packet)
-                        yield packet
-                except IndexError, e:
-                    logerr("decode failed: %s (%s)" % (e, _fmt(raw)))
-                    log_traceback(loglevel=syslog.LOG_DEBUG)
-            time.sleep(self._poll_interval)
+                if decoded:
+                    self._last_raw = raw
+                    self._last_decoded = decoded
+                    self._adapt_interval(decoded, True)
+                    return ts, decoded
+            except IndexError as e:
+                logerr("decode failed: %s (%s)" % (e, _fmt(raw)))
+                log_traceback(loglevel=syslog.LOG_DEBUG)
+            self._station.stats.count('decode_failed')
+        return None
+
+    def _adapt_interval(self, decoded, new_frame):
+        if self._adaptive is None:
+            return
+        interval = self._adaptive.update(decoded, new_frame)
+        if self._scheduler is not None and \
+                interval != self._scheduler.interval:
+            logdbg("poll interval is now %.1f" % interval)
+            self._scheduler.set_interval(interval)
+
+    @property
+    def poll_interval(self):
+        # the interval currently in use, which changes with adaptive polling
+        if self._scheduler is not None:
+            return self._scheduler.interval
+        return self._poll_interval
+
+    def get_stats(self):
+        stats = {'frames_read': self.frames_read,
+                 'frames_duplicate': self.frames_duplicate,
+                 'poll_interval': self.poll_interval}
+        if self._scheduler is not None:
+            stats['scheduler'] = self._scheduler.get_stats()
+        if self._adaptive is not None:
+            stats['adaptive'] = self._adaptive.get_stats()
+        if self._reader is not None:
+            stats['reader'] = self._reader.get_stats()
+        stats['stages'] = self._station.stats.get_stats()
+        return stats
 
     def _get_current(self):
         ntries = 0
         while ntries < self.max_tries:
             ntries += 1
             try:
-                return self._station.get_current()
-            except usb.USBError, e:
+                with self._station_lock:
+                    return self._station.get_current()
+            except usb.USBError as e:
                 if known_usb_err(e):
                     logdbg("get_current: %s" % e)
+                    self._station.stats.count('known_usb_err')
                     ntries -= 1
                 else:
                     logerr("get_current: failed attempt %d of %d: %s" %
                            (ntries, self.max_tries, e))
-            except weewx.WeeWxIOError, e:
+            except weewx.WeeWxIOError as e:
                 logerr("get_current: failed attempt %d of %d: %s" %
                        (ntries, self.max_tries, e))
+            self._station.stats.count('retries')
             time.sleep(self.retry_wait)
         msg = "read failed: max retries (%d) exceeded" % self.max_tries
         logerr(msg)
+        self._station.stats.count('retries_exceeded')
         raise weewx.RetriesExceeded(msg)
 
-    def _data_to_packet(self, data):
-        # convert from the dictionary-of-dictionaries to a simple dictionary
-        # of observation values.
+    def _data_to_packet(self, data, ts=None, changed=None):
+        # convert from the decoded weather data to a simple dictionary of
+        # observation values.  if a list of changed items is specified, the
+        # packet contains only the fields for those items.
         # FIXME: get measure of connectivity to sensors
         # FIXME: get measure of battery life/status
-        pkt = {'dateTime': int(time.time() + 0.5), 'usUnits': weewx.METRICWX}
-        pkt['windDir'] = data.get('wind_dir', {}).get('value')
-        pkt['windSpeed'] = data.get('wind_speed', {}).get('value')
-        pkt['windGust'] = data.get('gust_speed', {}).get('value')
-        pkt['inHumidity'] = data.get('in_humidity', {}).get('value')
-        pkt['outHumidity'] = data.get('out_humidity', {}).get('value')
-        pkt['inTemp'] = data.get('in_temp', {}).get('value')
-        pkt['outTemp'] = data.get('out_temp', {}).get('value')
-        pkt['pressure'] = data.get('abs_baro', {}).get('value')
-        pkt['luminosity'] = data.get('light', {}).get('value')
-        pkt['uv_raw'] = data.get('uv', {}).get('value')
-        pkt['UV'] = data.get('uvi', {}).get('value')
-        rain_total = data.get('rain_totals', {}).get('value')
-        pkt['rain'] = calculate_rain(rain_total, self.last_rain)
-        if self._debug_rain and self.last_rain != rain_total:
-            loginf("rain_delta is %s (rain_total=%s, rain_last=%s)" %
-                   (pkt['rain'], rain_total, self.last_rain))
-        self.last_rain = rain_total
+        if ts is None:
+            ts = time.time()
+        pkt = {'dateTime': int(ts + 0.5), 'usUnits': weewx.METRICWX}
+        values = data.values
+        for item, field in self._sensor_map:
+            if changed is not None and not changed[item]:
+                continue
+            x = values[item]
+            pkt[field] = None if x is WH23xxWeatherData._MISSING else x
         # use luminosity as an approximation for radiation.
         # FIXME: this probably should be done by StdWXCalculate
-        pkt['radiation'] = pkt['luminosity'] * LUMINOSITY_TO_RADIATION if pkt['luminosity'] is not None else None
+        if 'luminosity' in pkt:
+            pkt['radiation'] = pkt['luminosity'] * LUMINOSITY_TO_RADIATION if pkt['luminosity'] is not None else None
+        if self._rain_item is not None and (
+            changed is None or changed[self._rain_item]):
+            # rain is the difference between successive rain counters
+            rain_total = data.value(self._rain_item)
+            pkt['rain'] = calculate_rain(rain_total, self.last_rain)
+            if self._debug_rain and self.last_rain != rain_total:
+                loginf("rain_delta is %s (rain_total=%s, rain_last=%s)" %
+                       (pkt['rain'], rain_total, self.last_rain))
+            self.last_rain = rain_total
         return pkt
 
+    @staticmethod
+    def _compile_sensor_map(sensor_map):
+        # turn the map of field name to decoded label into a list of
+        # (item identifier, field name) so that building a packet is a
+        # single loop.  the rain field is special: it is calculated from
+        # the rain counter, so it is returned separately.
+        compiled = []
+        rain_item = None
+        for field in sorted(sensor_map):
+            label = sensor_map[field]
+            item = WH23xxStation.ITEM_IDS.get(label)
+            if item is None:
+                logerr("unknown label '%s' for field '%s' in sensor_map" %
+                       (label, field))
+            elif field == 'rain':
+                rain_item = item
+            else:
+                compiled.append((item, field))
+        return compiled, rain_item
+
+    @property
+    def archive_interval(self):
+        # the logging interval in the station, in seconds
+        if self._archive_interval is None:
+            info = self._station.get_station_info()
+            self._archive_interval = info['interval']
+            loginf('archive interval is %s' % self._archive_interval)
+        return self._archive_interval
+
+    def genStartupRecords(self, since_ts):
+        loginf("reading history records since %s" %
+               timestamp_to_string(since_ts))
+        n = 0
+        for pkt in self.genArchiveRecords(since_ts):
+            n += 1
+            yield pkt
+        loginf("read %s history records" % n)
+
+    def genArchiveRecords(self, since_ts):
+        # read records from the station logger.  the station gives us the
+        # record at since_ts as well, which we use only as the baseline for
+        # calculating rain.  if a read fails part way through, start over
+        # from the last record we emitted.
+        cursor = WH23xxHistoryCursor.load(self._cursor_file)
+        last_rain = None
+        ntries = 0
+        while True:
+            last = None
+            try:
+                records = self._station.get_history(since_ts, cursor)
+                while True:
+                    # hold the lock only while reading from the station, not
+                    # while weewx processes what we yield, so that polling in
+                    # a reader thread can go on.
+                    with self._station_lock:
+                        batch = list(itertools.islice(
+                            records, self.HISTORY_BATCH_SIZE))
+                    if not batch:
+                        return
+                    for ts, interval, data, addr in batch:
+                        last = (ts, interval, addr)
+                        if since_ts is None or ts > since_ts:
+                            yield self._history_to_packet(
+                                ts, interval, data, last_rain)
+                            since_ts = ts
+                        last_rain = data.get('rain_total')
+            except (usb.USBError, weewx.WeeWxIOError) as e:
+                ntries += 1
+                logerr("history: failed attempt %d of %d: %s" %
+                       (ntries, self.max_tries, e))
+                if ntries >= self.max_tries:
+                    msg = "history failed: max retries (%d) exceeded" % (
+                        self.max_tries)
+                    logerr(msg)
+                    self._station.stats.count('retries_exceeded')
+                    raise weewx.RetriesExceeded(msg)
+                time.sleep(self.retry_wait)
+            finally:
+                if last is not None:
+                    cursor = self._station.get_history_cursor(*last)
+                    cursor.save(self._cursor_file)
+
+    @staticmethod
+    def _history_to_packet(ts, interval, data, last_rain):
+        rec = {'dateTime': ts, 'usUnits': weewx.METRICWX,
+               'interval': max(1, interval // 60)}
+        rec['windDir'] = data.get('wind_dir')
+        rec['windSpeed'] = data.get('wind_speed')
+        rec['windGust'] = data.get('gust_speed')
+        rec['inHumidity'] = data.get('humidity_in')
+        rec['outHumidity'] = data.get('humidity_out')
+        rec['inTemp'] = data.get('temperature_in')
+        rec['outTemp'] = data.get('temperature_out')
+        rec['pressure'] = data.get('pressure')
+        rec['luminosity'] = data.get('light')
+        rec['uv_raw'] = data.get('uv')
+        rec['UV'] = data.get('uvi')
+        rec['rain'] = calculate_rain(data.get('rain_total'), last_rain)
+        rec['radiation'] = rec['luminosity'] * LUMINOSITY_TO_RADIATION if rec['luminosity'] is not None else None
+        return rec
+
+
+class WH23xxMultiDriver(weewx.drivers.AbstractDevice):
+    """Read from several stations at once.
+
+    Each station in the [[stations]] section has its own WH23xxDriver,
+    with the options from the driver section overridden by the options for
+    the station, such as bus and address or station_id to pick the device.
+    Each station is polled by its own reader thread, and the frames from all
+    of the stations go into a single queue.  The packets are emitted as a
+    single stream, with the fields for each station named with its prefix,
+    which defaults to the name of the station followed by an underscore.
+
+    There is a single metrics exporter and a single publisher for all of
+    the stations.  Metrics are labelled with the name of the station.  Only
+    packets are published, since a frame does not say which station it came
+    from.  A capture file must be specified for each station, not in the
+    driver section.
+
+    [WH23xx]
+        driver = user.wh23xx
+        [[stations]]
+            [[[north]]]
+                station_id = 0xbc7a2828
+                prefix = ''
+            [[[south]]]
+                bus = 1
+                address = 5
+    """
+
+    # options for the whole process, which must not be given to each station
+    SHARED_OPTIONS = ['metrics_port', 'metrics_address', 'metrics_textfile',
+                      'metrics_interval', 'publish_socket']
+
+    def __init__(self, stations=None, **stn_dict):
+        if not stations:
+            raise ValueError("no stations specified")
+        stn_dict.pop('history_cursor', None)
+        stn_dict.pop('device_cache', None)
+        if stn_dict.pop('capture_file', None):
+            logerr("ignoring capture_file: specify it for each station")
+        self._drivers = []
+        self._exporter = None
+        self._publisher = None
+        queue_size = int(stn_dict.get('queue_size', 10))
+        try:
+            for name in stations:
+                opts = dict(stn_dict)
+                opts.update(stations[name])
+                for key in self.SHARED_OPTIONS:
+                    opts.pop(key, None)
+                opts['acquisition'] = 'thread'
+                prefix = opts.pop('prefix', '%s_' % name)
+                loginf("station %s has prefix '%s'" % (name, prefix))
+                self._drivers.append((name, prefix, WH23xxDriver(**opts)))
+        except Exception:
+            self.closePort()
+            raise
+        # frames from different stations must not replace each other, so
+        # drop the oldest when the queue is full
+        self._queue = WH23xxFrameQueue(queue_size * len(self._drivers))
+        self._started = False
+        if stn_dict.get('publish_socket'):
+            self._publisher = WH23xxPublisher(stn_dict['publish_socket'])
+            self._publisher.start()
+        port = stn_dict.get('metrics_port')
+        textfile = stn_dict.get('metrics_textfile')
+        if port or textfile:
+            self._exporter = WH23xxMetricsExporter(
+                self.get_metrics, textfile=textfile,
+                address=stn_dict.get('metrics_address', '127.0.0.1'),
+                port=int(port) if port else None,
+                interval=float(stn_dict.get('metrics_interval', 15)))
+            self._exporter.start()
+
+    def closePort(self):
+        if self._exporter is not None:
+            self._exporter.stop()
+            self._exporter = None
+        if self._publisher is not None:
+            self._publisher.stop()
+            self._publisher = None
+        for _, _, driver in self._drivers:
+            driver.closePort()
+
+    @property
+    def hardware_name(self):
+        return ', '.join([d.hardware_name for _, _, d in self._drivers])
+
+    def genLoopPackets(self):
+        if not self._started:
+            self._start_readers()
+        last = [None] * len(self._drivers)
+        while True:
+            idx, ts, decoded = self._queue.get()
+            _, prefix, driver = self._drivers[idx]
+            changed = None
+            if driver.delta_packets and last[idx] is not None:
+                changed = decoded.get_changed_items(last[idx])
+            last[idx] = decoded
+            pkt = driver._data_to_packet(decoded, ts, changed)
+            packet = {'dateTime': pkt.pop('dateTime'),
+                      'usUnits': pkt.pop('usUnits')}
+            for field in pkt:
+                packet[prefix + field] = pkt[field]
+            if _debug_enabled():
+                logdbg("packet: %s" % packet)
+            if self._publisher is not None:
+                self._publisher.publish_packet(packet)
+            yield packet
+
+    def _start_readers(self):
+        for idx, (name, _, driver) in enumerate(self._drivers):
+            driver.start_reader(self._get_poller(idx, driver),
+                                queue=self._queue, name='wh23xx-%s' % name)
+        self._started = True
+
+    @staticmethod
+    def _get_poller(idx, driver):
+        # tag each frame with the index of the station it came from
+        def poll():
+            frame = driver._poll()
+            if frame:
+                return (idx,) + frame
+            return None
+        return poll
+
+    def get_stats(self):
+        stats = {'queue': self._queue.get_stats()}
+        for name, _, driver in self._drivers:
+            stats[name] = driver.get_stats()
+        return stats
+
+    def get_metrics(self):
+        # the stats of each station, for the metrics exporter
+        return {'stations': dict([(name, driver.get_stats())
+                                  for name, _, driver in self._drivers])}
+
+
+class WH23xxStats(object):
+    """Counters and timing histograms for each stage of reading the station.
+
+    Timings are in seconds, counted in buckets with the given upper bounds,
+    plus the total and the maximum.  With a reader thread, the reader and
+    the weewx thread both update the stats, so every update takes a lock.
+    """
+
+    BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+               0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.5, 5.0, 10.0]
+
+    def __init__(self):
+        self.counters = dict()
+        self.gauges = dict()
+        self.timings = dict()
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, stage, elapsed):
+        i = 3 + bisect.bisect_left(self.BUCKETS, elapsed)
+        with self._lock:
+            t = self.timings.get(stage)
+            if t is None:
+                # count, total, max, then a count for each bucket plus
+                # overflow
+                t = self.timings[stage] = [0, 0.0, 0.0] + [0] * (
+                    len(self.BUCKETS) + 1)
+            t[0] += 1
+            t[1] += elapsed
+            if elapsed > t[2]:
+                t[2] = elapsed
+            t[i] += 1
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timings.clear()
+
+    def get_stats(self):
+        # a consistent snapshot, so that the count of each timing matches
+        # its buckets
+        with self._lock:
+            stats = {'counters': dict(self.counters),
+                     'gauges': dict(self.gauges), 'timings': dict()}
+            for stage, t in self.timings.items():
+                stats['timings'][stage] = {
+                    'count': t[0], 'sum': t[1], 'max': t[2],
+                    'buckets': list(t[3:])}
+        return stats
+
+    @staticmethod
+    def quantile(timing, q):
+        # estimate a quantile from the buckets of a timing from get_stats
+        rank = q * timing['count']
+        n = 0
+        for i, c in enumerate(timing['buckets']):
+            n += c
+            if c and n >= rank:
+                if i < len(WH23xxStats.BUCKETS):
+                    return min(WH23xxStats.BUCKETS[i], timing['max'])
+                return timing['max']
+        return 0.0
+
+
+class WH23xxMetricsExporter(threading.Thread):
+    """Export driver metrics in the prometheus text format.
+
+    The metrics are served over http at /metrics, written periodically to a
+    file for the node exporter textfile collector, or both.  Everything is
+    done in this thread from snapshots of the driver statistics, so there is
+    nothing extra to do in the read path.  If the statistics are for several
+    stations, each sample is labelled with the name of its station.
+    """
+
+    COUNTERS = [
+        ('retries', 'failed reads that were retried'),
+        ('retries_exceeded', 'reads that failed after max_tries'),
+        ('known_usb_err', 'known usb errors that were ignored'),
+        ('checksum_mismatch', 'READ_RECORD replies with a bad checksum'),
+        ('usb_reset', 'usb resets of the station'),
+        ('probe_failed', 'stations that did not answer when opened')]
+
+    def __init__(self, get_stats, textfile=None, address='127.0.0.1',
+                 port=None, interval=15):
+        threading.Thread.__init__(self, name='wh23xx-metrics')
+        self.daemon = True
+        self._get_stats = get_stats
+        self.textfile = textfile
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._last_frames = dict()
+        self._server = None
+        if port is not None:
+            self._server = _make_metrics_server(address, port)
+            self._server.timeout = 1.0
+            self._server.exporter = self
+            loginf('serving metrics on %s:%s' % (address, port))
+        if textfile:
+            loginf('writing metrics to %s' % textfile)
+
+    def run(self):
+        last_write = None
+        try:
+            while not self._stop_event.is_set():
+                if self.textfile and (last_write is None or
+                                      _monotonic() - last_write >=
+                                      self.interval):
+                    last_write = _monotonic()
+                    self.write_textfile()
+                if self._server is not None:
+                    self._server.handle_request()
+                else:
+                    self._stop_event.wait(self.interval)
+        finally:
+            if self._server is not None:
+                self._server.server_close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(10)
+
+    def write_textfile(self):
+        # the collector may read at any time, so replace the file atomically
+        tmpname = self.textfile + '.tmp'
+        try:
+            with open(tmpname, 'w') as f:
+                f.write(self.render())
+            os.rename(tmpname, self.textfile)
+        except (IOError, OSError) as e:
+            logerr("cannot write metrics to %s: %s" % (self.textfile, e))
+
+    def render(self):
+        stats = self._get_stats()
+        now = _monotonic()
+        lines = []
+        # (label, stats) for each station.  a single station has no label.
+        if 'stations' in stats:
+            stations = [('station="%s"' % name, stats['stations'][name])
+                        for name in sorted(stats['stations'])]
+        else:
+            stations = [('', stats)]
+
+        def labels(label, extra=''):
+            x = ','.join([y for y in (label, extra) if y])
+            return '{%s}' % x if x else ''
+
+        def metric(name, mtype, helptext, samples):
+            lines.append('# HELP wh23xx_%s %s' % (name, helptext))
+            lines.append('# TYPE wh23xx_%s %s' % (name, mtype))
+            for label, value in samples:
+                lines.append('wh23xx_%s%s %s' % (name, labels(label), value))
+
+        for name, helptext in self.COUNTERS:
+            metric(name + '_total', 'counter', helptext,
+                   [(label, st['stages']['counters'].get(name, 0))
+                    for label, st in stations])
+        metric('frames_total', 'counter', 'frames read from the station',
+               [(label, st['frames_read']) for label, st in stations])
+        metric('duplicate_frames_total', 'counter',
+               'frames that were the same as the previous frame',
+               [(label, st['frames_duplicate']) for label, st in stations])
+        # frames per second since the previous export
+        samples = []
+        for label, st in stations:
+            fps = 0.0
+            last = self._last_frames.get(label)
+            if last is not None and now > last[1]:
+                fps = (st['frames_read'] - last[0]) / (now - last[1])
+            self._last_frames[label] = (st['frames_read'], now)
+            samples.append((label, fps))
+        metric('frames_per_second', 'gauge',
+               'frames read per second since the previous export', samples)
+        metric('poll_interval_seconds', 'gauge', 'current poll interval',
+               [(label, st['poll_interval']) for label, st in stations])
+        samples = [(label, st['reader']['depth'])
+                   for label, st in stations if 'reader' in st]
+        if samples:
+            metric('queue_depth', 'gauge', 'frames waiting in the queue',
+                   samples)
+        samples = [(label, st['stages']['gauges'])
+                   for label, st in stations
+                   if 'history_records_total' in st['stages']['gauges']]
+        if samples:
+            metric('history_records', 'gauge',
+                   'records in the current history download',
+                   [(label, g['history_records_total'])
+                    for label, g in samples])
+            metric('history_records_done', 'gauge',
+                   'records read so far in the current history download',
+                   [(label, g['history_records_done'])
+                    for label, g in samples])
+
+        lines.append('# HELP wh23xx_stage_seconds time spent in each stage')
+        lines.append('# TYPE wh23xx_stage_seconds histogram')
+        for label, st in stations:
+            timings = st['stages']['timings']
+            for stage in sorted(timings):
+                t = timings[stage]
+                n = 0
+                for bound, c in zip(WH23xxStats.BUCKETS, t['buckets']):
+                    n += c
+                    lines.append('wh23xx_stage_seconds_bucket%s %s' % (
+                        labels(label, 'stage="%s",le="%s"' % (stage, bound)),
+                        n))
+                lines.append('wh23xx_stage_seconds_bucket%s %s' % (
+                    labels(label, 'stage="%s",le="+Inf"' % stage),
+                    t['count']))
+                lines.append('wh23xx_stage_seconds_sum%s %s' % (
+                    labels(label, 'stage="%s"' % stage), t['sum']))
+                lines.append('wh23xx_stage_seconds_count%s %s' % (
+                    labels(label, 'stage="%s"' % stage), t['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def _make_metrics_server(address, port):
+    # the http server is needed only when the metrics are served over http
+    try:
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    except ImportError:
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+
+    class _WH23xxMetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ['/', '/metrics']:
+                self.send_error(404)
+                return
+            body = self.server.exporter.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            logdbg("metrics: %s %s" % (self.client_address[0], fmt % args))
+
+    return HTTPServer((address, port), _WH23xxMetricsHandler)
+
+
+class WH23xxPollScheduler(object):
+    """Schedule polls at fixed deadlines on a monotonic clock.
+
+    Sleeping for the poll interval after each poll makes every cycle drift by
+    however long the usb read, decoding, and processing by weewx took.  This
+    scheduler keeps polls on a fixed grid of deadlines instead.  If a poll
+    runs past one or more deadlines, for example during a string of retries,
+    the missed slots are skipped rather than run back-to-back, and the
+    overrun is counted.
+    """
+
+    def __init__(self, interval, clock=None, sleep=time.sleep):
+        self.clock = clock or _monotonic
+        self.sleep = sleep
+        self.interval = interval
+        self.next_deadline = self.clock()
+        self.polls = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.max_lateness = 0.0
+
+    def set_interval(self, interval):
+        # the new interval applies from the next deadline on
+        self.interval = interval
+
+    def wait(self):
+        # wait until the next deadline.  return the number of slots that
+        # were skipped because the last poll ran long.
+        self.polls += 1
+        now = self.clock()
+        if self.interval <= 0:
+            self.next_deadline = now
+            return 0
+        self.next_deadline += self.interval
+        missed = 0
+        if now > self.next_deadline:
+            lateness = now - self.next_deadline
+            missed = int(lateness // self.interval) + 1
+            self.next_deadline += missed * self.interval
+            self.overruns += 1
+            self.skipped += missed
+            self.max_lateness = max(self.max_lateness, lateness)
+            logdbg("poll overrun: %.3fs late, skipped %s slots" %
+                   (lateness, missed))
+        delay = self.next_deadline - now
+        if delay > 0:
+            self.sleep(delay)
+        return missed
+
+    def get_stats(self):
+        return {'polls': self.polls, 'overruns': self.overruns,
+                'skipped': self.skipped, 'max_lateness': self.max_lateness,
+                'interval': self.interval}
+
+
+class WH23xxAdaptivePoller(object):
+    """Choose the poll interval based on the weather.
+
+    When the gust speed or rain rate reaches its threshold, or the storm rain
+    increases, polling switches to the shortest interval to catch gusts and
+    bursts of rain.  Polling stays fast until conditions have been below a
+    lower exit threshold for the hold time, then backs off gradually to the
+    longest interval.  While polling fast, if few polls return a new frame
+    then the station is updating less often than we poll, so the interval is
+    stretched until the frames keep up, and shrinks back toward the shortest
+    interval while most polls return a new frame.
+    """
+
+    def __init__(self, min_interval, max_interval, gust_threshold=8.0,
+                 rain_rate_threshold=0.0, hold=120.0, backoff=1.5,
+                 exit_ratio=0.75, min_change_rate=0.3, clock=None):
+        self.clock = clock or _monotonic
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.gust_threshold = gust_threshold
+        self.rain_rate_threshold = rain_rate_threshold
+        self.hold = hold
+        self.backoff = backoff
+        self.exit_ratio = exit_ratio
+        self.min_change_rate = min_change_rate
+        self.interval = self.max_interval
+        self.active = False
+        self.bursts = 0
+        self.change_rate = 1.0
+        self._last_active = None
+        self._last_rain_event = None
+
+    def update(self, data, new_frame=True):
+        # update the state from the latest decoded data and return the
+        # interval to use for the next poll.
+        now = self.clock()
+        self.change_rate += 0.2 * ((1.0 if new_frame else 0.0) -
+                                   self.change_rate)
+        raining = self._is_raining(data)
+        if self._is_stormy(data, 1.0, raining):
+            if not self.active:
+                logdbg("adaptive polling: start burst")
+                self.active = True
+                self.bursts += 1
+                self.interval = self.min_interval
+            self._last_active = now
+        elif self.active and self._is_stormy(data, self.exit_ratio, raining):
+            self._last_active = now
+        elif self.active and now - self._last_active >= self.hold:
+            logdbg("adaptive polling: end burst")
+            self.active = False
+        if self.active:
+            if self.change_rate < self.min_change_rate:
+                self.interval = min(self.max_interval,
+                                    self.interval * self.backoff)
+            elif self.interval > self.min_interval:
+                self.interval = max(self.min_interval,
+                                    self.interval / self.backoff)
+        elif self.interval < self.max_interval:
+            self.interval = min(self.max_interval,
+                                self.interval * self.backoff)
+        return self.interval
+
+    def _is_stormy(self, data, ratio, raining):
+        # items that are missing or invalid do not count
+        unknown = (None, WH23xxWeatherData._MISSING)
+        values = data.values
+        gust = values[WH23xxStation.ITEM_GUSTSPEED]
+        if gust not in unknown and gust >= self.gust_threshold * ratio:
+            return True
+        rate = values[WH23xxStation.ITEM_RAINRATE]
+        if rate not in unknown and rate > self.rain_rate_threshold * ratio:
+            return True
+        return raining
+
+    def _is_raining(self, data):
+        # whether the storm rain has increased since the last update
+        event = data.values[WH23xxStation.ITEM_RAINEVENT]
+        if event in (None, WH23xxWeatherData._MISSING):
+            return False
+        last_event = self._last_rain_event
+        self._last_rain_event = event
+        return last_event is not None and event > last_event
+
+    def get_stats(self):
+        return {'interval': self.interval, 'active': self.active,
+                'bursts': self.bursts, 'change_rate': self.change_rate}
+
+
+class WH23xxFrameQueue(object):
+    """A bounded queue of frames from one or more reader threads.
+
+    When the queue is full, either the oldest frame is dropped
+    (drop-oldest), or the newest queued frame is replaced (coalesce).  If a
+    reader fails, its exception is raised to the consumer once everything
+    that was queued has been consumed.
+    """
+
+    OVERFLOW_POLICIES = ['drop-oldest', 'coalesce']
+
+    def __init__(self, size=10, overflow='drop-oldest'):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("unknown overflow policy '%s'" % overflow)
+        self._queue = collections.deque()
+        self._size = max(1, size)
+        self._overflow = overflow
+        self._cond = threading.Condition()
+        self._error = None
+        self.queued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def put(self, frame):
+        with self._cond:
+            if len(self._queue) >= self._size:
+                if self._overflow == 'coalesce':
+                    self._queue[-1] = frame
+                    self.coalesced += 1
+                else:
+                    self._queue.popleft()
+                    self._queue.append(frame)
+                    self.dropped += 1
+            else:
+                self._queue.append(frame)
+            self.queued += 1
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._cond.notify()
+
+    def fail(self, error):
+        with self._cond:
+            if self._error is None:
+                self._error = error
+            self._cond.notify()
+
+    def get(self):
+        # block until there is a frame, or raise the error from a reader
+        with self._cond:
+            while not self._queue and self._error is None:
+                self._cond.wait(1.0)
+            if self._queue:
+                return self._queue.popleft()
+            raise self._error
+
+    def get_stats(self):
+        with self._cond:
+            return {'depth': len(self._queue), 'max_depth': self.max_depth,
+                    'queued': self.queued, 'dropped': self.dropped,
+                    'coalesced': self.coalesced}
+
+
+class WH23xxReader(threading.Thread):
+    """Read from the station in a separate thread.
+
+    The thread polls the station on schedule and puts each decoded frame into
+    a WH23xxFrameQueue, so a slow consumer does not delay polling, and a slow
+    usb read does not hold up the consumer.  Several readers can share one
+    queue.  If reading fails, the exception is passed to the consumer.
+    """
+
+    def __init__(self, poll, interval, queue_size=10, overflow='drop-oldest',
+                 queue=None, name='wh23xx-reader'):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self._poll = poll
+        self.queue = queue or WH23xxFrameQueue(queue_size, overflow)
+        self._stop_event = threading.Event()
+        self.scheduler = WH23xxPollScheduler(interval,
+                                             sleep=self._stop_event.wait)
+
+    def run(self):
+        logdbg("%s thread started" % self.name)
+        try:
+            while not self._stop_event.is_set():
+                frame = self._poll()
+                if frame:
+                    self.queue.put(frame)
+                self.scheduler.wait()
+        except Exception as e:
+            logerr("%s thread failed: %s" % (self.name, e))
+            self.queue.fail(e)
+        logdbg("%s thread stopped" % self.name)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(10)
+
+    def get(self):
+        return self.queue.get()
+
+    def get_stats(self):
+        return self.queue.get_stats()
+
+
+class WH23xxPublisher(threading.Thread):
+    """Publish raw frames and packets to local subscribers.
+
+    Only one process can claim the usb interface, so the driver can share
+    what it reads on a unix domain socket.  Each message is a header with
+    the message type, the timestamp, and the payload length, followed by
+    the payload.  The payload of a FRAME is the raw READ_RECORD data; the
+    payload of a PACKET is the loop packet as json.  Sending never blocks:
+    a subscriber that falls so far behind that its socket buffer is full is
+    disconnected.
+    """
+
+    HEADER = struct.Struct('<BdI') # type, timestamp, payload length
+    FRAME = 0x01
+    PACKET = 0x02
+
+    def __init__(self, path):
+        threading.Thread.__init__(self, name='wh23xx-publisher')
+        self.daemon = True
+        self.path = path
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.published = 0
+        self.disconnected = 0
+        if os.path.exists(path):
+            os.unlink(path)
+        import socket
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(path)
+        self._sock.listen(5)
+        loginf('publishing on %s' % path)
+
+    def run(self):
+        import select
+        try:
+            while not self._stop_event.is_set():
+                ready = select.select([self._sock], [], [], 1.0)[0]
+                if ready:
+                    conn = self._sock.accept()[0]
+                    conn.setblocking(0)
+                    with self._lock:
+                        self._subscribers.append(conn)
+                    logdbg("publisher: new subscriber (%s total)" %
+                           len(self._subscribers))
+        finally:
+            self._sock.close()
+            with self._lock:
+                for conn in self._subscribers:
+                    conn.close()
+                self._subscribers = []
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(10)
+
+    def publish(self, msg_type, ts, payload):
+        if not self._subscribers:
+            return
+        import socket
+        msg = self.HEADER.pack(msg_type, ts, len(payload)) + bytes(payload)
+        with self._lock:
+            for conn in list(self._subscribers):
+                try:
+                    conn.sendall(msg)
+                except socket.error as e:
+                    logdbg("publisher: dropping subscriber: %s" % e)
+                    self._subscribers.remove(conn)
+                    conn.close()
+                    self.disconnected += 1
+            self.published += 1
+
+    def publish_frame(self, ts, raw):
+        self.publish(self.FRAME, ts, raw)
+
+    def publish_packet(self, packet):
+        self.publish(self.PACKET, packet['dateTime'],
+                     json.dumps(packet).encode('utf-8'))
+
+    @staticmethod
+    def read_message(sock):
+        # read one message from a subscriber socket.  return a tuple of
+        # (type, timestamp, payload), or None if the publisher went away.
+        hdr = WH23xxPublisher._recv_exact(sock, WH23xxPublisher.HEADER.size)
+        if hdr is None:
+            return None
+        msg_type, ts, size = WH23xxPublisher.HEADER.unpack(bytes(hdr))
+        payload = WH23xxPublisher._recv_exact(sock, size)
+        if payload is None:
+            return None
+        return msg_type, ts, payload
+
+    @staticmethod
+    def _recv_exact(sock, size):
+        buf = bytearray(size)
+        view = memoryview(buf)
+        pos = 0
+        while pos < size:
+            n = sock.recv_into(view[pos:], size - pos)
+            if not n:
+                return None
+            pos += n
+        return buf
+
+
+def _same_usb_id(a, b):
+    # bus and device names are usually numbers such as '001', but the legacy
+    # interface of pyusb 1.x can give names that are empty or not numbers
+    a = str(a).strip()
+    b = str(b).strip()
+    if a.isdigit() and b.isdigit():
+        return int(a) == int(b)
+    return a == b
+
+
+class WH23xxLegacyTransport(object):
+    """Transfers using the pyusb 0.4 interface.
+
+    This also works with the compatibility layer in pyusb 1.x, and with
+    anything else that implements the 0.4 device interface, such as a
+    WH23xxSimulator.
+    """
+
+    name = 'legacy'
+
+    def __init__(self, dev, iface=0):
+        self.dev = dev
+        self.iface = iface
+        self.devh = None
+
+    @staticmethod
+    def available():
+        return hasattr(usb, 'busses')
+
+    @staticmethod
+    def find(vendor_id, product_id, bus_id=None, address=None):
+        # yield the (bus, address) and device for each matching device,
+        # looking only at the specified bus and address, if any
+        for bus in usb.busses():
+            if bus_id is not None and not _same_usb_id(bus.dirname, bus_id):
+                continue
+            for dev in bus.devices:
+                if address is not None and not _same_usb_id(dev.filename,
+                                                            address):
+                    continue
+                if dev.idVendor == vendor_id and dev.idProduct == product_id:
+                    yield (bus.dirname, dev.filename), dev
+
+    def open(self):
+        self.devh = self.dev.open()
+        if not self.devh:
+            raise weewx.WeeWxIOError('Open USB device failed')
+        # be sure kernel does not claim the interface on linux systems
+        try:
+            self.devh.detachKernelDriver(self.iface)
+        except (AttributeError, usb.USBError):
+            pass
+
+    def claim(self):
+        self.devh.claimInterface(self.iface)
+        self.devh.setAltInterface(self.iface)
+
+    def close(self):
+        self.devh.releaseInterface()
+
+    def reset(self):
+        self.devh.reset()
+
+    def write(self, endpoint, buf, timeout):
+        return self.devh.interruptWrite(endpoint, buf, timeout)
+
+    def read(self, endpoint, size, timeout):
+        return self.devh.interruptRead(endpoint, size, timeout)
+
+
+class WH23xxCoreTransport(object):
+    """Transfers using the pyusb 1.x usb.core interface.
+
+    The endpoints are looked up once when the interface is claimed, and
+    each read goes into a preallocated buffer.  The buffer from a read is
+    reused by the next read, so callers must be done with it by then.
+    """
+
+    name = 'core'
+
+    def __init__(self, dev, iface=0):
+        self.dev = dev
+        self.iface = iface
+        self._endpoints = dict()
+        self._bufs = dict()
+
+    @staticmethod
+    def available():
+        return hasattr(usb, 'core') and hasattr(usb.core, 'find')
+
+    @staticmethod
+    def find(vendor_id, product_id, bus_id=None, address=None):
+        # let usb.core match the bus and address along with the ids, so that
+        # it does not look any further at other devices
+        match = {'idVendor': vendor_id, 'idProduct': product_id}
+        if bus_id is not None:
+            match['bus'] = int(bus_id)
+        if address is not None:
+            match['address'] = int(address)
+        for dev in usb.core.find(find_all=True, **match):
+            yield ('%03d' % dev.bus, '%03d' % dev.address), dev
+
+    def _is_core_device(self):
+        # anything else, such as a simulator, manages its own interface
+        return self.available() and isinstance(self.dev, usb.core.Device)
+
+    def open(self):
+        try:
+            if self.dev.is_kernel_driver_active(self.iface):
+                self.dev.detach_kernel_driver(self.iface)
+        except (NotImplementedError, usb.USBError):
+            pass
+
+    def claim(self):
+        try:
+            self.dev.set_configuration()
+        except usb.USBError as e:
+            # the device may already be configured
+            logdbg("set configuration failed: %s" % e)
+        intf = self.dev.get_active_configuration()[(self.iface, 0)]
+        self._endpoints = dict([(ep.bEndpointAddress, ep) for ep in intf])
+        if self._is_core_device():
+            usb.util.claim_interface(self.dev, self.iface)
+
+    def close(self):
+        self._endpoints = dict()
+        if self._is_core_device():
+            usb.util.release_interface(self.dev, self.iface)
+            usb.util.dispose_resources(self.dev)
+
+    def reset(self):
+        self.dev.reset()
+
+    def write(self, endpoint, buf, timeout):
+        return self._endpoints[endpoint].write(buf, timeout)
+
+    def read(self, endpoint, size, timeout):
+        buf = self._bufs.get(size)
+        if buf is None:
+            buf = self._bufs[size] = array.array('B', [0] * size)
+        n = self._endpoints[endpoint].read(buf, timeout)
+        return buf if n == size else buf[:n]
+
 
 class WH23xxStation(object):
     # usb values obtained from 'sudo lsusb -v'
@@ -501,6 +1809,12 @@ class WH23xxStation(object):
 
     CMD_RESULT = 0xf0
 
+    # the (bus, address) of every station that is open in this process
+    _open_devs = set()
+
+    # the ways of talking to usb, in order of preference
+    TRANSPORTS = [WH23xxCoreTransport, WH23xxLegacyTransport]
+
     PARAM_ITEM_ALARM = 0x0001
     PARAM_ITEM_TIMEZONE = 0x0002
     PARAM_ITEM_PARAM = 0x0004
@@ -521,6 +1835,17 @@ class WH23xxStation(object):
     INVALID_DATA_16 = 0xffff
     INVALID_DATA_32 = 0xffffffff
 
+    # layout of the eeprom, from the vendor documentation
+    EEPROM_SIZE = 0x10000
+    MAX_READ_SIZE = 56 # largest payload for a single READ_EEPROM
+    PAGE_FLAG_ADDR = 0x0259
+    PAGE_TABLE_ADDR = 0x02c8
+    PAGE_TABLE_ENTRY_SIZE = 8
+    HISTORY_ADDR = 0x0640
+    NUM_PAGES = 110
+    RECORDS_PER_PAGE = 32
+    RECORD_SIZE = 18
+
     ITEM_INTEMP = 0x01 # C
     ITEM_OUTTEMP = 0x02 # C
     ITEM_DEWPOINT = 0x03 # C
@@ -548,12 +1873,36 @@ class WH23xxStation(object):
     ITEM_TIME = 0x40
     ITEM_DATE = 0x80
 
-    def __init__(self):
+    def __init__(self, dev=None, bus=None, address=None, station_id=None,
+                 transport='auto', device_cache=None):
+        # dev is a usb device, or something that looks like one, such as a
+        # WH23xxSimulator.  if not specified, look for the station on usb,
+        # optionally at a specific bus and address, or with a specific
+        # station id.  the transport is core, legacy, or auto to use the
+        # best one that is available.  the device cache is a file that
+        # remembers where the station was found, so that the next open can
+        # try there before looking at every device.
+        self.dev = dev
+        self.transport = self.get_transport(transport, dev)
+        self.bus = bus
+        self.address = address
+        self.station_id = station_id
+        self._open_key = None
         self.vendor_id = 0x10c4
         self.product_id = 0x8468
         self.iface = 0
         self.timeout = 1000
+        self.probe_timeout = 250
+        self.device_cache = device_cache
         self.devh = None
+        # buffer for reassembling READ_RECORD replies: command, size, up to
+        # 255 bytes of data, and checksum
+        self._rbuf = bytearray(0x102)
+        self.stats = WH23xxStats()
+        self.capture = None # a WH23xxCapture to record every reply
+        self._history_index = None
+        self._history_flags = None
+        self._history_last_addr = None
 
     def __enter__(self):
         self.open()
@@ -563,29 +1912,143 @@ class WH23xxStation(object):
         self.close()
 
     def open(self):
-        dev = self._find_dev(self.vendor_id, self.product_id)
-        if not dev:
-            logerr("Cannot find USB device with VendorID=0x%04x ProductID=0x%04x" % (self.vendor_id, self.product_id))
-            raise weewx.WeeWxIOError('Unable to find station on USB')
+        t0 = _perf_counter()
+        self._open()
+        dt = _perf_counter() - t0
+        self.stats.observe('open', dt)
+        loginf("opened station in %.3f seconds" % dt)
+
+    def _open(self):
+        if self.dev:
+            self._open_dev(self.dev)
+            return
+        if self._open_cached():
+            return
+        for key, dev in self._find_devs(self.vendor_id, self.product_id,
+                                        self.bus, self.address,
+                                        self.transport):
+            if self.station_id is None:
+                self._open_dev(dev)
+                self._set_open_key(key)
+                return
+            # the station id is in the eeprom, so we have to open each
+            # station to find the one we want.  skip any that are in use.
+            try:
+                self._open_dev(dev)
+                if self._match_station_id():
+                    self._set_open_key(key)
+                    return
+            except (usb.USBError, weewx.WeeWxIOError) as e:
+                logdbg("skipping device: %s" % e)
+            self.close()
+        logerr("Cannot find USB device with VendorID=0x%04x ProductID=0x%04x"
+               " bus=%s address=%s station_id=%s" %
+               (self.vendor_id, self.product_id, self.bus, self.address,
+                self.station_id))
+        raise weewx.WeeWxIOError('Unable to find station on USB')
+
+    def _open_cached(self):
+        # try the device where the station was the last time.  if it is not
+        # there, or it is not the station we want, look everywhere.
+        key = self.load_device_cache(self.device_cache)
+        if key is None:
+            return False
+        if ((self.bus is not None and int(key[0]) != int(self.bus)) or
+            (self.address is not None and int(key[1]) != int(self.address))):
+            return False
+        for key, dev in self._find_devs(self.vendor_id, self.product_id,
+                                        key[0], key[1], self.transport):
+            try:
+                self._open_dev(dev)
+                if self.station_id is None or self._match_station_id():
+                    self._set_open_key(key)
+                    return True
+            except (usb.USBError, weewx.WeeWxIOError) as e:
+                logdbg("skipping cached device: %s" % e)
+            self.close()
+        loginf("station is not at cached location bus=%s device=%s" % key)
+        return False
 
-        self.devh = dev.open()
-        if not self.devh:
-            raise weewx.WeeWxIOError('Open USB device failed')
+    def _set_open_key(self, key):
+        self._open_key = key
+        WH23xxStation._open_devs.add(key)
+        if key != self.load_device_cache(self.device_cache):
+            self.save_device_cache(self.device_cache, key)
 
-        # be sure kernel does not claim the interface on linux systems
+    @staticmethod
+    def load_device_cache(filename):
+        # the (bus, address) from the device cache, or None
+        if not filename or not os.path.exists(filename):
+            return None
         try:
-            self.devh.detachKernelDriver(self.iface)
-        except (AttributeError, usb.USBError):
-            pass
+            with open(filename) as f:
+                d = json.load(f)
+            return (str(d['bus']), str(d['address']))
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            logerr("ignoring device cache %s: %s" % (filename, e))
+        return None
 
-        # attempt to unwedge the device
+    @staticmethod
+    def save_device_cache(filename, key):
+        # write to a temporary file then rename so that we never leave a
+        # partial cache behind.
+        if not filename:
+            return
+        tmpname = filename + '.tmp'
+        try:
+            with open(tmpname, 'w') as f:
+                json.dump({'bus': key[0], 'address': key[1]}, f)
+            os.rename(tmpname, filename)
+            logdbg("saved device cache: bus=%s device=%s" % key)
+        except (IOError, OSError) as e:
+            logerr("cannot save device cache %s: %s" % (filename, e))
+
+    def _match_station_id(self):
+        station_id = self.get_station_info()['id']
+        logdbg("found station id %s" % station_id)
+        return int(station_id, 16) == int(str(self.station_id), 0)
+
+    @staticmethod
+    def get_transport(name, dev=None):
+        # the transport class for the name.  for auto, use the first that
+        # is available, and that the device supports if one is specified.
+        for transport in WH23xxStation.TRANSPORTS:
+            if name == transport.name:
+                if not transport.available() and dev is None:
+                    raise weewx.WeeWxIOError("usb transport '%s' is not "
+                                             "available" % name)
+                return transport
+        if name != 'auto':
+            raise ValueError("unknown usb transport '%s'" % name)
+        for transport in WH23xxStation.TRANSPORTS:
+            if dev is None and transport.available():
+                return transport
+            if dev is not None and (
+                    transport is WH23xxLegacyTransport or
+                    hasattr(dev, 'get_active_configuration')):
+                return transport
+        raise weewx.WeeWxIOError('no usb transport is available')
+
+    def _open_dev(self, dev):
+        devh = self.transport(dev, self.iface)
+        devh.open()
+        self.devh = devh
+
+        # a station that answers does not need a reset, which can take
+        # several seconds.  otherwise release the interface and attempt to
+        # unwedge the device.
+        if self._probe():
+            return
+        try:
+            self.devh.close()
+        except (ValueError, usb.USBError) as e:
+            logdbg("release interface failed: %s" % e)
         self._reset()
 
         # attempt to claim the interface
         try:
-            self.devh.claimInterface(self.iface)
-            self.devh.setAltInterface(self.iface)
-        except usb.USBError, e:
+            self.devh.claim()
+        except usb.USBError as e:
             logerr("Unable to claim USB interface %s: %s" % (self.iface, e))
             self.close()
             raise weewx.WeeWxIOError(e)
@@ -593,10 +2056,26 @@ class WH23xxStation(object):
     def close(self):
         if self.devh:
             try:
-                self.devh.releaseInterface()
-            except (ValueError, usb.USBError), e:
+                self.devh.close()
+            except (ValueError, usb.USBError) as e:
                 logerr("release interface failed: %s" % e)
             self.devh = None
+        if self._open_key is not None:
+            WH23xxStation._open_devs.discard(self._open_key)
+            self._open_key = None
+
+    def _probe(self):
+        # claim the interface and see whether the station answers a
+        # READ_PARAM.  do not wait long, since a reset follows a failure.
+        try:
+            self.devh.claim()
+            param = self._read_param(self.probe_timeout)
+            logdbg("probe: station param is 0x%02x" % param)
+            return True
+        except (usb.USBError, weewx.WeeWxIOError) as e:
+            logdbg("probe failed: %s" % e)
+            self.stats.count('probe_failed')
+        return False
 
     def _reset(self):
         # use a usb reset to restore communication with the station.
@@ -605,27 +2084,41 @@ class WH23xxStation(object):
         # unfortunately it is not immediate.  sometimes it takes one reset.
         # sometimes it takes multiple resets.
         for x in range(5):
+            self.stats.count('usb_reset')
             try:
                 self.devh.reset()
                 break
-            except usb.USBError, e:
+            except usb.USBError as e:
                 logdbg("usb reset failed: %s" % e)
                 time.sleep(2)
 
     @staticmethod
     def _find_dev(vendor_id, product_id):
         """Find the vendor and product ID on the USB."""
-        for bus in usb.busses():
-            for dev in bus.devices:
-                if dev.idVendor == vendor_id and dev.idProduct == product_id:
-                    loginf('Found device on USB bus=%s device=%s' %
-                           (bus.dirname, dev.filename))
-                    return dev
+        for _, dev in WH23xxStation._find_devs(vendor_id, product_id):
+            return dev
         return None
 
-    def _write(self, label, buf):
-        logdbg("%s: write: %s" % (label, _fmt(buf)))
-        cnt = self.devh.interruptWrite(self.USB_ENDPOINT_OUT, buf, self.timeout)
+    @staticmethod
+    def _find_devs(vendor_id, product_id, bus_id=None, address=None,
+                   transport=WH23xxLegacyTransport):
+        """Find every device with the vendor and product ID on the USB,
+        optionally only those on a bus and/or at an address.  Yield the
+        (bus, address) and the device, skipping any that are already open
+        in this process."""
+        for key, dev in transport.find(vendor_id, product_id, bus_id, address):
+            if key in WH23xxStation._open_devs:
+                continue
+            loginf('Found device on USB bus=%s device=%s' % key)
+            yield key, dev
+
+    def _write(self, label, buf, timeout=None):
+        if _debug_enabled():
+            logdbg("%s: write: %s" % (label, _fmt(buf)))
+        t0 = _perf_counter()
+        cnt = self.devh.write(self.USB_ENDPOINT_OUT, buf,
+                              timeout or self.timeout)
+        self.stats.observe('usb_write', _perf_counter() - t0)
         if cnt != len(buf):
             raise weewx.WeeWxIOError('%s: bad write length=%s for command %s' %
                                      (label, cnt, _fmt(buf)))
@@ -642,33 +2135,62 @@ class WH23xxStation(object):
         buf.append(chksum)
         self._write("time_sync", buf)
 
+    def _read(self, label, timeout=None):
+        t0 = _perf_counter()
+        buf = self.devh.read(
+            self.USB_ENDPOINT_IN,
+            self.USB_PACKET_SIZE,
+            timeout or self.timeout)
+        self.stats.observe('usb_read', _perf_counter() - t0)
+        if _debug_enabled():
+            logdbg("%s: buf: %s" % (label, _fmt(buf)))
+        return buf
+
+    @staticmethod
+    def _copy_payload(pkt, buf, pos, need):
+        # copy the payload of a usb packet into buf at pos, skipping the
+        # 0x01 and payload size that start every usb packet.  never copy
+        # more than we need.  return the new position in buf.
+        n = pkt[1]
+        if not 0 < n <= len(pkt) - 2:
+            n = len(pkt) - 2
+        n = min(n, need - pos)
+        buf[pos:pos + n] = pkt[2:2 + n]
+        return pos + n
+
     def _read_eeprom(self, addr, size):
+        buf = bytearray(size)
+        self._read_eeprom_into(addr, size, buf, 0)
+        return buf
+
+    def _read_eeprom_into(self, addr, size, buf, offset):
         # initiate a read by sending the READ_EEPROM command.
         addr_lo = addr & 0xff
-        addr_hi = (addr / 256) & 0xff
+        addr_hi = (addr // 256) & 0xff
         cmd = [WH23xxStation.READ_EEPROM, addr_lo, addr_hi, size]
         chksum = _calc_checksum(cmd)
-        buf = [0x02, 0x05]
-        buf.extend(cmd)
-        buf.append(chksum)
-        self._write("read_eeprom", buf)
+        cmd = [0x02, 0x05] + cmd + [chksum]
+        self._write("read_eeprom", cmd)
 
-        # now do the actual read.
-        buf = self.devh.interruptRead(
-            self.USB_ENDPOINT_IN,
-            self.USB_PACKET_SIZE,
-            self.timeout)
-        if not buf:
+        # now do the actual read.  the reply fits in a single usb packet.
+        # put the data directly into the caller's buffer.
+        pkt = self._read("read_eeprom")
+        if not pkt:
             raise weewx.WeeWxIOError('read_eeprom failed: empty read')
-        logdbg("read_eeprom: buf: %s" % _fmt(buf))
-        if buf[0] != 0x01 or buf[2] != WH23xxStation.READ_EEPROM:
+        if pkt[0] != 0x01 or pkt[2] != WH23xxStation.READ_EEPROM:
             raise weewx.WeeWxIOError('read_eeprom: bad reply: '
                                      'got %02x %02x %02x %02x, '
                                      'exp 01 .. %02x ..' %
-                                     (buf[0], buf[1], buf[2], buf[3],
+                                     (pkt[0], pkt[1], pkt[2], pkt[3],
                                       WH23xxStation.READ_EEPROM))
-        logdbg("read_eeprom: size: %s" % buf[3])
-        return buf[4:]
+        if _debug_enabled():
+            logdbg("read_eeprom: size: %s" % pkt[3])
+        if pkt[3] < size or len(pkt) < size + 4:
+            raise weewx.WeeWxIOError('read_eeprom: short read at 0x%04x: '
+                                     '%s < %s' % (addr, pkt[3], size))
+        buf[offset:offset + size] = pkt[4:4 + size]
+        if self.capture is not None:
+            self.capture.write(self.READ_EEPROM, addr, buf[offset:offset + size])
 
     def _read_record(self):
         # initiate a read by sending the READ_RECORD command.
@@ -680,58 +2202,85 @@ class WH23xxStation(object):
         # now do the actual read.  the station should respond with a single
         # READ_RECORD response spread over (probably) multiple USB packets.
         # each USB packet starts with two bytes, 0x01 followed by the usb
-        # packet size.  we check these, but ignore them.  the response
-        # contains the READ_RECORD reply, the size of the reply data, the
-        # reply data, and a checksum.
-        tmp = []
-        record_size = 0
-        buf = self.devh.interruptRead(
-            self.USB_ENDPOINT_IN,
-            self.USB_PACKET_SIZE,
-            self.timeout)
-        if not buf:
+        # payload size.  the response contains the READ_RECORD reply, the
+        # size of the reply data, the reply data, and a checksum.  put the
+        # response into the preallocated buffer, then checksum it in place.
+        rbuf = self._rbuf
+        pkt = self._read("read_record")
+        if not pkt:
             logdbg("read_record: empty read")
             return None
-        logdbg("read_record: buf: %s" % _fmt(buf))
-        if buf[0] != 0x01:
+        if pkt[0] != 0x01:
             raise weewx.WeeWxIOError('read_record: bad first byte: '
-                                     '0x%02x != 0x01' % buf[0])
-        if buf[2] != WH23xxStation.READ_RECORD:
+                                     '0x%02x != 0x01' % pkt[0])
+        if pkt[2] != WH23xxStation.READ_RECORD:
             raise weewx.WeeWxIOError('read_record: missing READ_RECORD: '
                                      '0x%02x != 0x%02x' %
-                                     (buf[2], WH23xxStation.READ_RECORD))
-        record_size = buf[3]
-        logdbg("read_record: record_size: %s" % record_size)
-        tmp.extend(buf[4:]) # skip 0x01, payload_size, 0x04, record_size
+                                     (pkt[2], WH23xxStation.READ_RECORD))
+        record_size = pkt[3]
+        if _debug_enabled():
+            logdbg("read_record: record_size: %s" % record_size)
+        need = record_size + 3 # READ_RECORD, record_size, data, checksum
+        t0 = _perf_counter()
+        pos = self._copy_payload(pkt, rbuf, 0, need)
+        t_copy = _perf_counter() - t0
         cnt = 0
         max_cnt = 20
-        while len(tmp) < record_size and cnt < max_cnt:
+        while pos < need:
+            if cnt >= max_cnt:
+                raise weewx.WeeWxIOError("read_record: max_cnt reads exceeded")
             cnt += 1
-            buf = self.devh.interruptRead(
-                self.USB_ENDPOINT_IN,
-                self.USB_PACKET_SIZE,
-                self.timeout)
-            logdbg("read_record: buf: %s" % _fmt(buf))
-            tmp.extend(buf[2:]) # skip 0x01 and payload_size
-        if cnt >= max_cnt:
-            raise weewx.WeeWxIOError("read_record: max_cnt reads exceeded")
-        rbuf = tmp[0:record_size] # prune off any dangling bytes
-        chksum_pkt = tmp[record_size]
-
-        # package up just the bytes we care about
-        tmp = [WH23xxStation.READ_RECORD, record_size]
-        tmp.extend(rbuf)
+            pkt = self._read("read_record")
+            if not pkt:
+                raise weewx.WeeWxIOError("read_record: empty read after "
+                                         "%s of %s bytes" % (pos, need))
+            if pkt[0] != 0x01:
+                raise weewx.WeeWxIOError('read_record: bad first byte: '
+                                         '0x%02x != 0x01' % pkt[0])
+            t0 = _perf_counter()
+            pos = self._copy_payload(pkt, rbuf, pos, need)
+            t_copy += _perf_counter() - t0
+        self.stats.observe('reassembly', t_copy)
 
         # verify the checksum for the packet
-        chksum = _calc_checksum(tmp)
-        logdbg("read_record: rbuf: %s chksum_pkt=%02x chksum=0x%02x" %
-               (_fmt(rbuf), chksum_pkt, chksum))
+        t0 = _perf_counter()
+        chksum = sum(itertools.islice(rbuf, 0, need - 1)) & 0xff
+        chksum_pkt = rbuf[need - 1]
+        self.stats.observe('checksum', _perf_counter() - t0)
+        if _debug_enabled():
+            logdbg("read_record: rbuf: %s chksum_pkt=%02x chksum=0x%02x" %
+                   (_fmt(rbuf[2:need - 1]), chksum_pkt, chksum))
         if chksum != chksum_pkt:
+            self.stats.count('checksum_mismatch')
             logerr("read_record: checksum mismatch: 0x%02x != 0x%02x (%s)" %
-                   (chksum_pkt, chksum, _fmt(rbuf)))
+                   (chksum_pkt, chksum, _fmt(rbuf[2:need - 1])))
             raise weewx.WeeWxIOError("read_record: checksum mismatch: "
                                      "%02x != %02x" % (chksum_pkt, chksum))
-        return rbuf
+        # the buffer is reused for the next read, so hand out a copy of just
+        # the record bytes.
+        raw = rbuf[2:need - 1]
+        if self.capture is not None:
+            self.capture.write(self.READ_RECORD, 0, raw)
+        return raw
+
+    def _read_param(self, timeout=None):
+        # the reply is READ_PARAM, size, a single byte of data, and checksum
+        buf = [0x02, 0x02,
+               WH23xxStation.READ_PARAM,
+               WH23xxStation.READ_PARAM]
+        self._write("read_param", buf, timeout)
+        pkt = self._read("read_param", timeout)
+        if not pkt:
+            raise weewx.WeeWxIOError('read_param failed: empty read')
+        if (len(pkt) < 6 or pkt[0] != 0x01 or
+            pkt[2] != WH23xxStation.READ_PARAM):
+            raise weewx.WeeWxIOError('read_param: bad reply: %s' %
+                                     _fmt(pkt[:6]))
+        chksum = _calc_checksum(pkt[2:5])
+        if chksum != pkt[5]:
+            raise weewx.WeeWxIOError("read_param: checksum mismatch: "
+                                     "%02x != %02x" % (pkt[5], chksum))
+        return pkt[4]
 
     def _clear_max_min(self):
         logdbg("clear max/min")
@@ -752,6 +2301,9 @@ class WH23xxStation(object):
     def get_current(self):
         return self._read_record()
 
+    def get_param(self):
+        return self._read_param()
+
     def sync_time(self):
         self._time_sync(time.time())
 
@@ -767,95 +2319,338 @@ class WH23xxStation(object):
         buf = self._read_eeprom(0x0000, 56)
         return self.decode_station_info(buf)
 
-    # this map associates the item identifier with [label, num_bytes, function]
-    # required for decoding weather data from raw bytes.
+    def read_eeprom(self, addr, size):
+        # read an arbitrary range of memory into a single buffer.  the station
+        # will return at most MAX_READ_SIZE bytes per READ_EEPROM, so use the
+        # biggest chunks we can to minimize the number of usb round trips.
+        if addr < 0 or addr + size > self.EEPROM_SIZE:
+            raise weewx.WeeWxIOError('read_eeprom: range 0x%04x+%s is '
+                                     'beyond end of memory' % (addr, size))
+        buf = bytearray(size)
+        pos = 0
+        while pos < size:
+            n = min(size - pos, self.MAX_READ_SIZE)
+            self._read_eeprom_into(addr + pos, n, buf, pos)
+            pos += n
+        return buf
+
+    def get_page_flags(self):
+        # each byte is the number of records in the corresponding page
+        return self.read_eeprom(self.PAGE_FLAG_ADDR, self.NUM_PAGES)
+
+    def get_page_table(self):
+        # each entry is the timestamp and interval of a page
+        raw = self.read_eeprom(self.PAGE_TABLE_ADDR,
+                               self.NUM_PAGES * self.PAGE_TABLE_ENTRY_SIZE)
+        return self.decode_page_table(raw)
+
+    def get_history(self, since_ts=None, cursor=None):
+        # generator that yields (timestamp, interval, record, address) for
+        # every record in the logger with a timestamp at or after since_ts,
+        # in chronological order.  the interval is in seconds.
+        done = 0
+        for run, raw in self.get_history_runs(since_ts, cursor):
+            for rec in self.decode_history_run(run, raw):
+                done += 1
+                self.stats.set_gauge('history_records_done', done)
+                yield rec
+
+    def get_history_runs(self, since_ts=None, cursor=None):
+        # generator that yields (segments, raw) for the records at or after
+        # since_ts, where raw is the records of segments that are next to
+        # each other in memory, read all at once.
+        segments = self.get_history_segments(since_ts, cursor)
+        for run in WH23xxHistoryIndex.get_runs(segments):
+            nrec = sum([seg[1] for seg in run])
+            yield run, self.read_eeprom(run[0][0], nrec * self.RECORD_SIZE)
+
+    def get_history_segments(self, since_ts=None, cursor=None):
+        # return a list of (address, count, timestamp, interval) for the
+        # records at or after since_ts, in chronological order.  if there is
+        # a cursor from a previous read, try to resume from there, otherwise
+        # use the index to find the first record.
+        flags = None
+        segments = None
+        refresh = False
+        if (cursor is not None and since_ts is not None and
+            cursor.timestamp <= since_ts):
+            flags = self.get_page_flags()
+            segments = self._get_cursor_segments(cursor, flags)
+            if segments is None:
+                # the station memory has changed too much to trust what we
+                # knew about it, so start over with the whole page table
+                loginf("history cursor does not match station memory")
+                refresh = True
+            else:
+                logdbg("history: resume from cursor at 0x%04x (%s)" %
+                       (cursor.address, cursor.timestamp))
+                # the records between the cursor and since_ts are not
+                # wanted, so do not read them
+                segments = list(segments)
+                self._history_last_addr = self._get_last_address(
+                    segments, cursor.address)
+                segments = WH23xxHistoryIndex.trim_segments(segments,
+                                                            since_ts)
+        if segments is None:
+            index = self.get_history_index(flags, refresh)
+            flags = index.flags
+            logdbg("history: %s of %s records since %s" %
+                   (index.count_since(since_ts), len(index), since_ts))
+            self._history_last_addr = self._get_last_address(
+                list(index.get_segments()))
+            segments = index.get_segments(since_ts)
+        self._history_flags = flags
+        segments = list(segments)
+        self.stats.set_gauge('history_records_total',
+                             sum([seg[1] for seg in segments]))
+        self.stats.set_gauge('history_records_done', 0)
+        return segments
+
+    @staticmethod
+    def decode_history_run(run, raw):
+        # yield (timestamp, interval, record, address) for each record in
+        # the segments of a run, where raw is the records of the run
+        idx = 0
+        for addr, n, ts, interval in run:
+            for i in range(n):
+                data = WH23xxStation.decode_history_record(
+                    raw[idx:idx + WH23xxStation.RECORD_SIZE])
+                idx += WH23xxStation.RECORD_SIZE
+                yield (ts + i * interval, interval, data,
+                       addr + i * WH23xxStation.RECORD_SIZE)
+
+    def get_history_cursor(self, ts, interval, addr):
+        # cursor for a record that was returned by get_history.  only a
+        # cursor at the newest record gets a fingerprint, since a matching
+        # fingerprint means there is nothing after the cursor to read.
+        record = WH23xxHistoryCursor.get_record(addr)
+        page_start = ts - record * interval
+        fingerprint = None
+        if addr == self._history_last_addr:
+            fingerprint = WH23xxHistoryCursor.get_fingerprint(
+                self._history_flags, page_start, interval)
+        return WH23xxHistoryCursor(addr, ts, page_start, interval,
+                                   fingerprint)
+
+    @staticmethod
+    def _get_last_address(segments, default=None):
+        # address of the newest record in the segments
+        if not segments:
+            return default
+        addr, count = segments[-1][:2]
+        return addr + (count - 1) * WH23xxStation.RECORD_SIZE
+
+    def _get_cursor_segments(self, cursor, flags):
+        # starting with the record at the cursor, walk forward through the
+        # pages in the order the station writes them.  this needs only the
+        # page flags and the page table entries just after the cursor.
+        # return None if the cursor does not match the station memory, for
+        # example when the history has been cleared or the logger wrapped.
+        page = cursor.page
+        count = self.page_count(flags[page])
+        if count <= cursor.record:
+            return None
+        entries = dict()
+        n = self.MAX_READ_SIZE // self.PAGE_TABLE_ENTRY_SIZE
+        for p, entry in zip(range(page, min(page + n, self.NUM_PAGES)),
+                            self.get_page_timestamps(page, n)):
+            entries[p] = entry
+        if entries[page] != (cursor.page_start, cursor.interval):
+            return None
+        if cursor.fingerprint == WH23xxHistoryCursor.get_fingerprint(
+                flags, cursor.page_start, cursor.interval):
+            return [] # nothing has been logged since the cursor
+        segments = [(cursor.address, count - cursor.record,
+                     cursor.timestamp, cursor.interval)]
+        last_ts = cursor.page_start + (count - 1) * cursor.interval
+        p = page
+        while True:
+            p = (p + 1) % self.NUM_PAGES
+            count = self.page_count(flags[p])
+            if not count:
+                break
+            if p not in entries:
+                if p == 0 and page + n > self.NUM_PAGES:
+                    for i, entry in enumerate(self.get_page_timestamps(
+                            0, page + n - self.NUM_PAGES)):
+                        entries[i] = entry
+                else:
+                    return None # too many new pages, use the index instead
+            if entries[p] is None or entries[p][0] <= last_ts:
+                break # this page has older records, so we are done
+            ts, interval = entries[p]
+            segments.append((self.page_address(p), count, ts, interval))
+            last_ts = ts + (count - 1) * interval
+        return segments
+
+    def get_history_index(self, flags=None, refresh=False):
+        # the page flags change every time the station logs a record, so
+        # always read them.  the page table changes only when a page is
+        # started, so unless refresh is set, read only the entries for
+        # pages that were started since we last looked.
+        if flags is None:
+            flags = self.get_page_flags()
+        table = None
+        if not refresh and self._history_index is not None:
+            table = self._get_started_pages(self._history_index)
+        if table is None:
+            table = self.get_page_table()
+        self._history_index = WH23xxHistoryIndex(flags, table)
+        return self._history_index
+
+    def _get_started_pages(self, index):
+        # the page table from the index with the entries of any pages that
+        # were started since it was built.  the station starts pages in
+        # order, so those are the pages after the newest page in the index,
+        # up to the first page whose entry has not changed.  the page count
+        # is no help here, since a page that is started again can fill up
+        # to the count it had before.  if the newest page itself changed,
+        # the history was cleared or the logger went all the way around, so
+        # return None and let the caller read the whole table.
+        if not index.pages:
+            return None
+        table = list(index.table)
+        newest = index.pages[-1][1]
+        n = self.MAX_READ_SIZE // self.PAGE_TABLE_ENTRY_SIZE
+        page = newest
+        entries = []
+        for _ in range(self.NUM_PAGES):
+            if not entries:
+                entries = self.get_page_timestamps(page, n)
+            entry = entries.pop(0)
+            if page == newest:
+                if entry != table[page]:
+                    return None
+            elif entry == table[page]:
+                return table
+            table[page] = entry
+            page = (page + 1) % self.NUM_PAGES
+        return None
+
+    def get_page_timestamp(self, page):
+        return self.get_page_timestamps(page, 1)[0]
+
+    def get_page_timestamps(self, page, n):
+        n = min(n, self.NUM_PAGES - page)
+        addr = self.PAGE_TABLE_ADDR + page * self.PAGE_TABLE_ENTRY_SIZE
+        raw = self.read_eeprom(addr, n * self.PAGE_TABLE_ENTRY_SIZE)
+        return self.decode_page_table(raw)
+
+    @staticmethod
+    def page_address(page):
+        return (WH23xxStation.HISTORY_ADDR +
+                page * WH23xxStation.RECORDS_PER_PAGE *
+                WH23xxStation.RECORD_SIZE)
+
+    @staticmethod
+    def page_count(flag):
+        # 0x01-0x20 is the number of records, 0xff means the page is unused
+        if 0 < flag <= WH23xxStation.RECORDS_PER_PAGE:
+            return flag
+        return 0
+
+    # this map associates the item identifier with [label, num_bytes, divisor,
+    # offset] required for decoding weather data from raw bytes.  the value is
+    # raw / divisor + offset, or just the raw integer if there is no divisor.
     ITEM_MAPPING = {
-        ITEM_INTEMP: ['in_temp', 2, lambda x : x / 10.0 - 40.0],
-        ITEM_OUTTEMP: ['out_temp', 2, lambda x : x / 10.0 - 40.0],
-        ITEM_DEWPOINT: ['dewpoint', 2, lambda x : x / 10.0 - 40.0],
-        ITEM_WINDCHILL: ['windchill', 2, lambda x : x / 10.0 - 40.0],
-        ITEM_HEATINDEX: ['heatindex', 2, lambda x : x / 10.0 - 40.0],
-        ITEM_INHUMI: ['in_humidity', 1, lambda x : x],
-        ITEM_OUTHUMI: ['out_humidity', 1, lambda x : x],
-        ITEM_ABSBARO: ['abs_baro', 2, lambda x : x / 10.0],
-        ITEM_RELBARO: ['rel_baro', 2, lambda x : x / 10.0],
-        ITEM_WINDDIRECTION: ['wind_dir', 2, lambda x : x],
-        ITEM_WINDSPEED: ['wind_speed', 2, lambda x : x / 10.0],
-        ITEM_GUSTSPEED: ['gust_speed', 2, lambda x : x / 10.0],
-        ITEM_RAINEVENT: ['rain_event', 4, lambda x : x / 10.0],
-        ITEM_RAINRATE: ['rain_rate', 4, lambda x : x / 10.0],
-        ITEM_RAINHOUR: ['rain_hour', 4, lambda x : x / 10.0],
-        ITEM_RAINDAY: ['rain_day', 4, lambda x : x / 10.0],
-        ITEM_RAINWEEK: ['rain_week', 4, lambda x : x / 10.0],
-        ITEM_RAINMONTH: ['rain_month', 4, lambda x : x / 10.0],
-        ITEM_RAINYEAR: ['rain_year', 4, lambda x : x / 10.0],
-        ITEM_RAINTOTALS: ['rain_totals', 4, lambda x : x / 10.0],
-        ITEM_LIGHT: ['light', 4, lambda x : x / 10.0],
-        ITEM_UV: ['uv', 2, lambda x : x ],
-        ITEM_UVI: ['uvi', 1, lambda x : x],
+        ITEM_INTEMP: ['in_temp', 2, 10.0, -40.0],
+        ITEM_OUTTEMP: ['out_temp', 2, 10.0, -40.0],
+        ITEM_DEWPOINT: ['dewpoint', 2, 10.0, -40.0],
+        ITEM_WINDCHILL: ['windchill', 2, 10.0, -40.0],
+        ITEM_HEATINDEX: ['heatindex', 2, 10.0, -40.0],
+        ITEM_INHUMI: ['in_humidity', 1, None, None],
+        ITEM_OUTHUMI: ['out_humidity', 1, None, None],
+        ITEM_ABSBARO: ['abs_baro', 2, 10.0, None],
+        ITEM_RELBARO: ['rel_baro', 2, 10.0, None],
+        ITEM_WINDDIRECTION: ['wind_dir', 2, None, None],
+        ITEM_WINDSPEED: ['wind_speed', 2, 10.0, None],
+        ITEM_GUSTSPEED: ['gust_speed', 2, 10.0, None],
+        ITEM_RAINEVENT: ['rain_event', 4, 10.0, None],
+        ITEM_RAINRATE: ['rain_rate', 4, 10.0, None],
+        ITEM_RAINHOUR: ['rain_hour', 4, 10.0, None],
+        ITEM_RAINDAY: ['rain_day', 4, 10.0, None],
+        ITEM_RAINWEEK: ['rain_week', 4, 10.0, None],
+        ITEM_RAINMONTH: ['rain_month', 4, 10.0, None],
+        ITEM_RAINYEAR: ['rain_year', 4, 10.0, None],
+        ITEM_RAINTOTALS: ['rain_totals', 4, 10.0, None],
+        ITEM_LIGHT: ['light', 4, 10.0, None],
+        ITEM_UV: ['uv', 2, None, None],
+        ITEM_UVI: ['uvi', 1, None, None],
         }
 
+    # the mapping compiled into a table indexed by item identifier.  the
+    # light sensor reports 0xffffff when there is no sensor (firmware bug).
+    ITEM_DECODERS = _compile_item_mapping(ITEM_MAPPING, {ITEM_LIGHT: 0xffffff})
+
+    # map from label to item identifier
+    ITEM_IDS = dict((v[0], k) for k, v in ITEM_MAPPING.items())
+
     @staticmethod
     def decode_weather_data(raw):
+        # decode a sequence of bytes into current weather data.  put the
+        # result into a dictionary that contains a dictionary for each
+        # observation.  if there is a failure, the dictionary is empty.
+        return WH23xxStation.decode_weather_record(raw).as_dict()
+
+    @staticmethod
+    def decode_weather_record(raw):
         # decode a sequence of bytes into current weather data.  the sequence
         # can be variable length.  an identifier byte is followed by one to
         # four data bytes.  identifier bytes have a value of ITEM_* bitwise
         # or with date and/or time if there is an associated time.
         #
-        # so we simply walk the array, decoding as we go.  put the result into
-        # a dictionary that contains a dictionary for each observation.
+        # so we simply walk the array, decoding as we go using the compiled
+        # item decoders.  put the result into a WH23xxWeatherData, which
+        # holds the values in a list indexed by item identifier.
         #
-        # if there is a failure, log it and bail out.
-        data = dict()
+        # if there is a failure, log it and bail out with an empty result.
+        buf = raw if isinstance(raw, bytearray) else bytearray(raw)
+        decoders = WH23xxStation.ITEM_DECODERS
+        n = len(buf)
+        rec = WH23xxWeatherData()
+        values = rec.values
         i = 0
-        while i < len(raw):
-            item = item_raw = raw[i]
+        while i < n:
+            item_raw = buf[i]
             i += 1
-
-            has_date = (item & WH23xxStation.ITEM_DATE) != 0
-            has_time = (item & WH23xxStation.ITEM_TIME) != 0
-
-            if has_date:
-                item = item & ~WH23xxStation.ITEM_DATE
-            if has_time:
-                item = item & ~WH23xxStation.ITEM_TIME
-
-            label = None
-            obs = dict()
-            mapping = WH23xxStation.ITEM_MAPPING.get(item)
-            if mapping:
-                if i + mapping[1] - 1 >= len(raw):
-                    logerr("not enough bytes for %s: idx=%s nbytes=%s bytes=%s"
-                           % (mapping[0], i, mapping[1], raw))
-                    return dict()
-                # bytes are decoded MSB first, then function is applied
-                label = mapping[0]
-                obs['value'] = _decode_bytes(raw, i, mapping[1], mapping[2])
-                i += mapping[1]
-            else:
+            item = item_raw & 0x3f
+            dec = decoders[item]
+            if dec is None:
                 logerr("no mapping for item id 0x%02x (0x%02x)"
                        " at index %s of %s" % (item, item_raw, i-1, _fmt(raw)))
-                return dict()
-
-            if has_date:
-                # year.month.day
-                obs['date'] = "%04d.%02d.%02d" % (
-                    2000 + raw[i], raw[i+1], raw[i+2])
+                return WH23xxWeatherData()
+            label, nbytes, unpack, invalid, divisor, offset = dec
+            if i + nbytes > n:
+                logerr("not enough bytes for %s: idx=%s nbytes=%s bytes=%s"
+                       % (label, i, nbytes, _fmt(raw)))
+                return WH23xxWeatherData()
+            x = unpack(buf, i)[0]
+            i += nbytes
+            if rec.dates is not None:
+                rec.dates[item] = None
+            if rec.times is not None:
+                rec.times[item] = None
+            if x in invalid:
+                values[item] = None
+            elif divisor is None:
+                values[item] = x
+            elif offset is None:
+                values[item] = x / divisor
+            else:
+                values[item] = x / divisor + offset
+            if item_raw & 0x80:
+                # year, month, day, formatted only when asked for
+                if rec.dates is None:
+                    rec.dates = [None] * WH23xxWeatherData.NUM_ITEMS
+                rec.dates[item] = (buf[i] << 16) + (buf[i+1] << 8) + buf[i+2]
                 i += 3
-
-            if has_time:
-                # hour:minute
-                obs['time'] = "%02d:%02d" % (raw[i], raw[i+1])
+            if item_raw & 0x40:
+                # hour, minute
+                if rec.times is None:
+                    rec.times = [None] * WH23xxWeatherData.NUM_ITEMS
+                rec.times[item] = (buf[i] << 8) + buf[i+1]
                 i += 2
-
-            # workaround firmware bug for invalid light value
-            if (item == WH23xxStation.ITEM_LIGHT and
-                obs['value'] == 0xffffff / 10.0):
-                obs['value'] = None
-
-            logdbg("%s: %s (0x%02x 0x%02x)" % (label, obs, item, item_raw))
-            data[label] = obs
-        return data
+        return rec
 
     @staticmethod
     def decode_history_record(raw):
@@ -874,18 +2669,18 @@ class WH23xxStation(object):
             return data
         x = ((raw[0] & 0x01) << 8) + raw[1]
         data['wind_dir'] = None if x == 0x1ff else x # compass degree
-        x = (((raw[0] & 0x02) / 0x02) << 8) + raw[2]
+        x = (((raw[0] & 0x02) // 0x02) << 8) + raw[2]
         data['wind_speed'] = None if x == 0x1ff else x / 10.0 # m/s
-        x = (((raw[0] & 0x04) / 0x04) << 8) + raw[3]
+        x = (((raw[0] & 0x04) // 0x04) << 8) + raw[3]
         data['gust_speed'] = None if x == 0x1ff else x / 10.0 # m/s
-        data['rain_total'] = ((((raw[0] & 0x08) / 0x08) << 16) + (raw[5] << 8) + raw[4]) * 0.1 # 0.0-9999.9 mm
-        data['rain_overflow'] = (raw[0] & 0x10) / 0x10 # bit 4
-        data['no_sensors'] = (raw[0] & 0x80) / 0x80 # bit 7
+        data['rain_total'] = ((((raw[0] & 0x08) // 0x08) << 16) + (raw[5] << 8) + raw[4]) * 0.1 # 0.0-9999.9 mm
+        data['rain_overflow'] = (raw[0] & 0x10) // 0x10 # bit 4
+        data['no_sensors'] = (raw[0] & 0x80) // 0x80 # bit 7
         data['humidity_in'] = None if raw[6] == 0xff else raw[6]
         data['humidity_out'] = None if raw[7] == 0xff else raw[7]
         x = ((raw[9] & 0x0f) << 8) + raw[8]
         data['temperature_in'] = None if x == 0xfff else x / 10.0 - 40.0 # C
-        x = ((raw[9] & 0xf0) << 8) + raw[10]
+        x = ((raw[9] & 0xf0) << 4) + raw[10]
         data['temperature_out'] = None if x == 0xfff else x / 10.0 - 40.0 # C
         x = (raw[11] << 8) + raw[12]
         data['pressure'] = None if x == 0xffff else x / 10.0 # hpa
@@ -896,6 +2691,78 @@ class WH23xxStation(object):
         data['uvi'] = _uv_to_uvi(data['uv'])
         return data
 
+    @staticmethod
+    def decode_history_records(raw):
+        # decode a buffer of contiguous 18-byte records all at once.  this
+        # uses numpy to decode each field as a column, so it is much faster
+        # than decode_history_record when there are many records.  returns a
+        # dictionary of arrays with the same keys as decode_history_record.
+        # invalid values are masked.
+        if numpy is None:
+            raise ImportError("numpy is required to decode history in batch")
+        if isinstance(raw, (list, tuple)):
+            a = numpy.array(raw, dtype=numpy.uint8)
+        else:
+            a = numpy.frombuffer(raw, dtype=numpy.uint8)
+        n = len(a) // 18
+        if len(a) != n * 18:
+            logdbg("ignoring %s trailing bytes in raw data" % (len(a) - n * 18))
+        a = a[:n * 18].reshape(n, 18).astype(numpy.int32)
+        b0 = a[:, 0]
+        ma = numpy.ma
+        data = dict()
+        x = ((b0 & 0x01) << 8) + a[:, 1]
+        data['wind_dir'] = ma.masked_where(x == 0x1ff, x)
+        x = (((b0 & 0x02) >> 1) << 8) + a[:, 2]
+        data['wind_speed'] = ma.masked_where(x == 0x1ff, x / 10.0)
+        x = (((b0 & 0x04) >> 2) << 8) + a[:, 3]
+        data['gust_speed'] = ma.masked_where(x == 0x1ff, x / 10.0)
+        x = (((b0 & 0x08) >> 3) << 16) + (a[:, 5] << 8) + a[:, 4]
+        data['rain_total'] = x * 0.1
+        data['rain_overflow'] = (b0 & 0x10) >> 4
+        data['no_sensors'] = (b0 & 0x80) >> 7
+        data['humidity_in'] = ma.masked_equal(a[:, 6], 0xff)
+        data['humidity_out'] = ma.masked_equal(a[:, 7], 0xff)
+        x = ((a[:, 9] & 0x0f) << 8) + a[:, 8]
+        data['temperature_in'] = ma.masked_where(x == 0xfff, x / 10.0 - 40.0)
+        x = ((a[:, 9] & 0xf0) << 4) + a[:, 10]
+        data['temperature_out'] = ma.masked_where(x == 0xfff, x / 10.0 - 40.0)
+        x = (a[:, 11] << 8) + a[:, 12]
+        data['pressure'] = ma.masked_where(x == 0xffff, x / 10.0)
+        x = (a[:, 15] << 16) + (a[:, 14] << 8) + a[:, 13]
+        data['light'] = ma.masked_where(x == 0xffffff, x / 10.0)
+        x = (a[:, 17] << 8) + a[:, 16]
+        data['uv'] = ma.masked_equal(x, 0xffff)
+        uvi = numpy.searchsorted(UV_THRESHOLDS, x, side='right')
+        uvi[uvi >= len(UV_THRESHOLDS)] = 0xff
+        data['uvi'] = ma.masked_where(x == 0xffff, uvi)
+        return data
+
+    @staticmethod
+    def decode_page_table(raw):
+        # each 8-byte entry is year, month, day, hour, minute, second, then
+        # the interval in seconds (lo, hi).  return a list with a tuple of
+        # (timestamp, interval) for each page, or None for unused pages.
+        table = []
+        size = WH23xxStation.PAGE_TABLE_ENTRY_SIZE
+        for i in range(0, len(raw) - size + 1, size):
+            table.append(WH23xxStation.decode_page_timestamp(raw[i:i + size]))
+        return table
+
+    @staticmethod
+    def decode_page_timestamp(raw):
+        if raw[0] == 0xff or raw[1] == 0xff:
+            return None
+        interval = raw[7] * 256 + raw[6]
+        if not interval or interval == 0xffff:
+            return None
+        try:
+            ts = time.mktime((2000 + raw[0], raw[1], raw[2],
+                              raw[3], raw[4], raw[5], 0, 0, -1))
+        except (ValueError, OverflowError):
+            return None
+        return int(ts), interval
+
     @staticmethod
     def decode_station_info(raw):
         data = dict()
@@ -951,6 +2818,1286 @@ class WH23xxStation(object):
         return data
 
 
+class WH23xxClientStation(WH23xxStation):
+    """A station that reads from the socket of a WH23xxPublisher.
+
+    This gets the current data from a driver that is already talking to
+    the station, without touching usb.  Only the current data are
+    available; reading the eeprom or history raises an error.
+    """
+
+    def __init__(self, path):
+        super(WH23xxClientStation, self).__init__()
+        self.path = path
+        self._sock = None
+
+    def open(self):
+        import socket
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(self.path)
+        except socket.error as e:
+            self._sock.close()
+            self._sock = None
+            raise weewx.WeeWxIOError('cannot connect to %s: %s' %
+                                     (self.path, e))
+        loginf('reading from publisher at %s' % self.path)
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def read_message(self):
+        # the next message of any type from the publisher
+        msg = WH23xxPublisher.read_message(self._sock)
+        if msg is None:
+            raise weewx.WeeWxIOError('publisher at %s went away' % self.path)
+        return msg
+
+    def get_current(self):
+        # return the most recent frame.  wait for one if none are queued.
+        import select
+        raw = None
+        while True:
+            if raw is not None and not select.select(
+                    [self._sock], [], [], 0)[0]:
+                return raw
+            msg_type, _, payload = self.read_message()
+            if msg_type == WH23xxPublisher.FRAME:
+                raw = payload
+
+    def _write(self, label, buf, timeout=None):
+        raise weewx.WeeWxIOError('%s: not available from a publisher' % label)
+
+    def _reset(self):
+        pass
+
+
+class WH23xxCapture(object):
+    """Record the replies from the station to a file.
+
+    The file starts with a header of MAGIC and the wall clock time at the
+    start of the capture.  Each reply is a record header with the command,
+    the monotonic time since the start of the capture, the eeprom address
+    (zero for READ_RECORD), and the length of the data, followed by the
+    data.  If the filename ends with .gz the file is compressed.
+    """
+
+    MAGIC = b'WH23CAP1'
+    FILE_HEADER = struct.Struct('<8sd')
+    HEADER = struct.Struct('<BdHH') # command, time, address, length
+
+    def __init__(self, filename):
+        import gzip
+        self.filename = filename
+        opener = gzip.open if filename.endswith('.gz') else open
+        self._f = opener(filename, 'wb')
+        self._f.write(self.FILE_HEADER.pack(self.MAGIC, time.time()))
+        self._t0 = _monotonic()
+        self.count = 0
+        loginf('capturing to %s' % filename)
+
+    def write(self, cmd, addr, data):
+        self._f.write(self.HEADER.pack(cmd, _monotonic() - self._t0, addr,
+                                       len(data)))
+        self._f.write(bytes(data))
+        self.count += 1
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+            loginf('captured %s replies to %s' % (self.count, self.filename))
+
+    @staticmethod
+    def read(filename):
+        # generator that yields (command, time, address, data) for each
+        # record in a capture file.  the start time is in the first tuple,
+        # with a command of None.
+        import gzip
+        with open(filename, 'rb') as f:
+            compressed = f.read(2) == b'\x1f\x8b'
+        opener = gzip.open if compressed else open
+        f = opener(filename, 'rb')
+        try:
+            hdr = f.read(WH23xxCapture.FILE_HEADER.size)
+            if len(hdr) < WH23xxCapture.FILE_HEADER.size:
+                raise weewx.WeeWxIOError('%s: not a capture file' % filename)
+            magic, start = WH23xxCapture.FILE_HEADER.unpack(hdr)
+            if magic != WH23xxCapture.MAGIC:
+                raise weewx.WeeWxIOError('%s: not a capture file' % filename)
+            yield None, start, None, None
+            size = WH23xxCapture.HEADER.size
+            while True:
+                hdr = f.read(size)
+                if len(hdr) < size:
+                    break
+                cmd, t, addr, n = WH23xxCapture.HEADER.unpack(hdr)
+                data = bytearray(f.read(n))
+                if len(data) < n:
+                    logerr("%s: truncated record at end of file" % filename)
+                    break
+                yield cmd, t, addr, data
+        finally:
+            f.close()
+
+
+class WH23xxReplayStation(WH23xxStation):
+    """A station that replays the replies recorded by a WH23xxCapture.
+
+    get_current returns the captured READ_RECORD replies in order, paced to
+    match the original timing divided by speed, or as fast as possible if
+    speed is zero.  EEPROM reads are answered from the captured READ_EEPROM
+    replies.  At the end of the capture, get_current raises EOFError.
+    """
+
+    def __init__(self, filename, speed=1.0):
+        super(WH23xxReplayStation, self).__init__()
+        self.filename = filename
+        self.speed = speed
+        self._records = None
+        self._eeprom = dict()
+        self._t0 = None
+
+    def open(self):
+        # collect the eeprom replies first, so that they can be read in any
+        # order, then start over for the READ_RECORD replies.
+        self._eeprom = dict()
+        for cmd, _, addr, data in WH23xxCapture.read(self.filename):
+            if cmd == self.READ_EEPROM:
+                self._eeprom[(addr, len(data))] = data
+        self._records = WH23xxCapture.read(self.filename)
+        start = next(self._records)[1]
+        self._t0 = None
+        loginf('replaying %s captured at %s at speed %s' %
+               (self.filename, timestamp_to_string(int(start)), self.speed))
+
+    def close(self):
+        self._records = None
+
+    def get_current(self):
+        for cmd, t, _, data in self._records:
+            if cmd == self.READ_RECORD:
+                self._wait(t)
+                self.stats.count('replayed')
+                return data
+        raise EOFError('end of capture %s' % self.filename)
+
+    def _wait(self, t):
+        now = _monotonic()
+        if self._t0 is None:
+            self._t0 = now - t / self.speed if self.speed > 0 else now
+        if self.speed > 0:
+            delay = self._t0 + t / self.speed - now
+            if delay > 0:
+                time.sleep(delay)
+
+    def _read_eeprom_into(self, addr, size, buf, offset):
+        data = self._eeprom.get((addr, size))
+        if data is None:
+            raise weewx.WeeWxIOError('read_eeprom: 0x%04x+%s was not captured'
+                                     % (addr, size))
+        buf[offset:offset + size] = data
+
+    def _write(self, label, buf, timeout=None):
+        raise weewx.WeeWxIOError('%s: not available in a replay' % label)
+
+    def _reset(self):
+        pass
+
+
+class WH23xxWeatherData(object):
+    """Current weather data decoded from a READ_RECORD frame.
+
+    Values are stored in a list indexed by the ITEM_* identifier, with
+    _MISSING for items that were not in the frame.  Max/min dates and times
+    are kept as the raw integers and formatted only when asked for.  The
+    dictionary-of-dictionaries interface of decode_weather_data is available
+    by label, for example data['in_temp'] or data.as_dict().
+    """
+
+    NUM_ITEMS = 0x18
+    _MISSING = object()
+
+    __slots__ = ('values', 'dates', 'times')
+
+    def __init__(self):
+        self.values = [WH23xxWeatherData._MISSING] * WH23xxWeatherData.NUM_ITEMS
+        self.dates = None
+        self.times = None
+
+    def value(self, item):
+        x = self.values[item]
+        return None if x is WH23xxWeatherData._MISSING else x
+
+    def has_item(self, item):
+        return self.values[item] is not WH23xxWeatherData._MISSING
+
+    def date(self, item):
+        # year.month.day
+        if self.dates is None or self.dates[item] is None:
+            return None
+        x = self.dates[item]
+        return "%04d.%02d.%02d" % (2000 + (x >> 16), (x >> 8) & 0xff, x & 0xff)
+
+    def time(self, item):
+        # hour:minute
+        if self.times is None or self.times[item] is None:
+            return None
+        x = self.times[item]
+        return "%02d:%02d" % (x >> 8, x & 0xff)
+
+    def items(self):
+        return [(label, self[label]) for label in self.keys()]
+
+    def keys(self):
+        return [WH23xxStation.ITEM_DECODERS[item][0]
+                for item in range(WH23xxWeatherData.NUM_ITEMS)
+                if self.has_item(item)]
+
+    def get(self, label, default=None):
+        return self[label] if label in self else default
+
+    def get_changed_items(self, other):
+        # return a list, indexed by item identifier, that is True for each
+        # item whose value, date, or time is different in other.
+        if other is self:
+            return [False] * WH23xxWeatherData.NUM_ITEMS
+        changed = [a != b for a, b in zip(self.values, other.values)]
+        if self.dates is not None or other.dates is not None:
+            for item in range(WH23xxWeatherData.NUM_ITEMS):
+                if self.date(item) != other.date(item):
+                    changed[item] = True
+        if self.times is not None or other.times is not None:
+            for item in range(WH23xxWeatherData.NUM_ITEMS):
+                if self.time(item) != other.time(item):
+                    changed[item] = True
+        return changed
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def __getitem__(self, label):
+        item = WH23xxStation.ITEM_IDS[label]
+        if not self.has_item(item):
+            raise KeyError(label)
+        obs = {'value': self.values[item]}
+        if self.dates is not None and self.dates[item] is not None:
+            obs['date'] = self.date(item)
+        if self.times is not None and self.times[item] is not None:
+            obs['time'] = self.time(item)
+        return obs
+
+    def __contains__(self, label):
+        item = WH23xxStation.ITEM_IDS.get(label)
+        return item is not None and self.has_item(item)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        n = 0
+        for x in self.values:
+            if x is not WH23xxWeatherData._MISSING:
+                n += 1
+        return n
+
+    def __eq__(self, other):
+        if isinstance(other, WH23xxWeatherData):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+
+class WH23xxHistoryIndex(object):
+    """Time index over the pages of the station logger.
+
+    The index is built from the page flags (number of records in each page)
+    and the page table (timestamp and interval of the first record in each
+    page).  Pages are sorted by timestamp, so a bisect on the page start times
+    maps a time to the page and record that contain it, and from there to an
+    address in the station memory.
+    """
+
+    def __init__(self, flags, table):
+        self.flags = list(flags)
+        self.table = list(table)
+        # each page is (timestamp, page, count, interval)
+        self.pages = []
+        for page in range(min(len(self.flags), len(self.table))):
+            count = WH23xxStation.page_count(self.flags[page])
+            if count and self.table[page] is not None:
+                ts, interval = self.table[page]
+                self.pages.append((ts, page, count, interval))
+        self.pages.sort()
+        self.start_times = [p[0] for p in self.pages]
+
+    def __len__(self):
+        return sum([p[2] for p in self.pages])
+
+    def locate(self, ts):
+        # return (i, record) of the first record at or after ts, where i is
+        # the index into the sorted pages.  if there is no such record then
+        # i is the number of pages.
+        if ts is None:
+            return 0, 0
+        i = bisect.bisect_right(self.start_times, ts) - 1
+        if i < 0:
+            return 0, 0
+        start, _, count, interval = self.pages[i]
+        rec = int(math.ceil((ts - start) / float(interval)))
+        if rec >= count:
+            return i + 1, 0
+        return i, rec
+
+    def get_address(self, ts):
+        # memory address of the first record at or after ts, or None
+        i, rec = self.locate(ts)
+        if i >= len(self.pages):
+            return None
+        return (WH23xxStation.page_address(self.pages[i][1]) +
+                rec * WH23xxStation.RECORD_SIZE)
+
+    def count_since(self, ts):
+        i, rec = self.locate(ts)
+        return sum([p[2] for p in self.pages[i:]]) - rec
+
+    def get_segments(self, ts=None):
+        # yield (address, count, timestamp, interval) for each page, or part
+        # of a page, with records at or after ts.
+        i, rec = self.locate(ts)
+        for start, page, count, interval in self.pages[i:]:
+            addr = WH23xxStation.page_address(page)
+            yield (addr + rec * WH23xxStation.RECORD_SIZE, count - rec,
+                   start + rec * interval, interval)
+            rec = 0
+
+    @staticmethod
+    def trim_segments(segments, ts):
+        # yield the segments without the records before ts.  the segments
+        # must be in chronological order.
+        for addr, count, start, interval in segments:
+            rec = 0
+            if ts is not None and ts > start:
+                rec = int(math.ceil((ts - start) / float(interval)))
+            if rec < count:
+                yield (addr + rec * WH23xxStation.RECORD_SIZE, count - rec,
+                       start + rec * interval, interval)
+
+    @staticmethod
+    def get_runs(segments):
+        # group segments that are adjacent in memory so that each run can be
+        # read with as few READ_EEPROM commands as possible.
+        run = []
+        for seg in segments:
+            if run and seg[0] != run[-1][0] + run[-1][1] * WH23xxStation.RECORD_SIZE:
+                yield run
+                run = []
+            run.append(seg)
+        if run:
+            yield run
+
+
+class WH23xxHistoryCursor(object):
+    """Position of the last history record read from the station.
+
+    The cursor is saved to disk so that a restart can resume reading history
+    where it left off.  It records the address and timestamp of the record,
+    the page table entry of the page that contains it, and a fingerprint of
+    the page flags and that page table entry.  If the page table entry no
+    longer matches, the history was cleared or the logger wrapped, and the
+    cursor is no longer useful.  If the fingerprint matches, nothing new has
+    been logged.
+    """
+
+    def __init__(self, address, timestamp, page_start, interval,
+                 fingerprint):
+        self.address = address
+        self.timestamp = timestamp
+        self.page_start = page_start
+        self.interval = interval
+        self.fingerprint = fingerprint
+
+    def __repr__(self):
+        return "page=%s record=%s address=0x%04x timestamp=%s" % (
+            self.page, self.record, self.address, self.timestamp)
+
+    @property
+    def page(self):
+        return WH23xxHistoryCursor.get_page(self.address)
+
+    @property
+    def record(self):
+        return WH23xxHistoryCursor.get_record(self.address)
+
+    @staticmethod
+    def get_page(addr):
+        return ((addr - WH23xxStation.HISTORY_ADDR) //
+                (WH23xxStation.RECORDS_PER_PAGE * WH23xxStation.RECORD_SIZE))
+
+    @staticmethod
+    def get_record(addr):
+        return ((addr - WH23xxStation.HISTORY_ADDR) //
+                WH23xxStation.RECORD_SIZE) % WH23xxStation.RECORDS_PER_PAGE
+
+    @staticmethod
+    def get_fingerprint(flags, page_start, interval):
+        buf = bytearray(flags) + bytearray(struct.pack('<II', page_start,
+                                                       interval))
+        return zlib.crc32(bytes(buf)) & 0xffffffff
+
+    @staticmethod
+    def load(filename):
+        if not filename or not os.path.exists(filename):
+            return None
+        try:
+            with open(filename) as f:
+                d = json.load(f)
+            cursor = WH23xxHistoryCursor(
+                int(d['address']), int(d['timestamp']), int(d['page_start']),
+                int(d['interval']), d.get('fingerprint'))
+            if not 0 <= cursor.page < WH23xxStation.NUM_PAGES:
+                raise ValueError("bad address 0x%04x" % cursor.address)
+            logdbg("loaded history cursor: %s" % cursor)
+            return cursor
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            logerr("ignoring history cursor %s: %s" % (filename, e))
+        return None
+
+    def save(self, filename):
+        # write to a temporary file then rename so that we never leave a
+        # partial cursor behind.
+        if not filename:
+            return
+        d = {'address': self.address, 'timestamp': self.timestamp,
+             'page_start': self.page_start, 'interval': self.interval,
+             'fingerprint': self.fingerprint}
+        tmpname = filename + '.tmp'
+        try:
+            with open(tmpname, 'w') as f:
+                json.dump(d, f)
+            os.rename(tmpname, filename)
+            logdbg("saved history cursor: %s" % self)
+        except (IOError, OSError) as e:
+            logerr("cannot save history cursor %s: %s" % (filename, e))
+
+
+class WH23xxImage(object):
+    """The file format for an image of the station eeprom.
+
+    The file is a header of IMAGE_OFFSET bytes followed by the EEPROM_SIZE
+    bytes of the eeprom.  The header contains MAGIC, the format version,
+    the chunk size used for reading, the station id and model, the time of
+    the dump, and a bitmap with one bit per chunk that has been read.
+    Chunks that were not read, such as unused history pages, are 0xff.
+    """
+
+    MAGIC = b'WH23IMG1'
+    VERSION = 1
+    HEADER = struct.Struct('<8sBHIHd') # magic, version, chunk size, id,
+                                       # model, time
+    IMAGE_OFFSET = 512
+    CHUNK_SIZE = WH23xxStation.MAX_READ_SIZE
+    NUM_CHUNKS = (WH23xxStation.EEPROM_SIZE + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+    def __init__(self, station_id=0, model=0, ts=0, bitmap=None):
+        self.station_id = station_id
+        self.model = model
+        self.ts = ts
+        self.bitmap = bitmap or bytearray((self.NUM_CHUNKS + 7) // 8)
+
+    def __str__(self):
+        return "id=0x%08x model=0x%04x time=%s chunks=%s/%s" % (
+            self.station_id, self.model, timestamp_to_string(int(self.ts)),
+            self.count_chunks(), self.NUM_CHUNKS)
+
+    def has_chunk(self, i):
+        return self.bitmap[i // 8] & (1 << (i % 8)) != 0
+
+    def set_chunk(self, i):
+        self.bitmap[i // 8] |= 1 << (i % 8)
+
+    def clear_chunk(self, i):
+        self.bitmap[i // 8] &= ~(1 << (i % 8)) & 0xff
+
+    def count_chunks(self):
+        return sum([bin(x).count('1') for x in self.bitmap])
+
+    def pack(self):
+        hdr = bytearray(self.IMAGE_OFFSET)
+        h = self.HEADER.pack(self.MAGIC, self.VERSION, self.CHUNK_SIZE,
+                             self.station_id, self.model, self.ts)
+        hdr[0:len(h)] = h
+        hdr[len(h):len(h) + len(self.bitmap)] = self.bitmap
+        return hdr
+
+    @staticmethod
+    def unpack(buf):
+        # return the header from the start of an image file, or None if it
+        # is not an image file.
+        h = WH23xxImage.HEADER
+        if len(buf) < WH23xxImage.IMAGE_OFFSET:
+            return None
+        magic, version, chunk_size, station_id, model, ts = h.unpack(
+            bytes(buf[0:h.size]))
+        if (magic != WH23xxImage.MAGIC or version != WH23xxImage.VERSION or
+            chunk_size != WH23xxImage.CHUNK_SIZE):
+            return None
+        nbytes = (WH23xxImage.NUM_CHUNKS + 7) // 8
+        return WH23xxImage(station_id, model, ts,
+                           bytearray(buf[h.size:h.size + nbytes]))
+
+    @staticmethod
+    def read_header(filename):
+        with open(filename, 'rb') as f:
+            return WH23xxImage.unpack(f.read(WH23xxImage.IMAGE_OFFSET))
+
+
+class WH23xxDumper(object):
+    """Dump the station eeprom to an image file.
+
+    The eeprom is read in the largest chunks the station allows.  Each chunk
+    is retried with a short exponential backoff.  Only the history pages
+    that the page flags say are in use are read.  Progress is saved in the
+    image header, so a dump that is interrupted resumes where it stopped
+    when run again on the same file.  When resuming, everything outside the
+    history pages is read again, as is any history page whose flag or page
+    table entry has changed since the image was started.
+    """
+
+    def __init__(self, station, filename, max_tries=5, backoff=0.1):
+        self.station = station
+        self.filename = filename
+        self.max_tries = max_tries
+        self.backoff = backoff
+        self.image = None
+        self.buf = None
+        self.chunks_read = 0
+        self.chunks_skipped = 0
+        self.pages_refreshed = 0
+        self.retries = 0
+
+    def run(self):
+        self._open()
+        t_start = time.time()
+        try:
+            # the configuration, page flags, and page table come first, then
+            # the used part of each history page, then whatever is after the
+            # history pages.
+            st = WH23xxStation
+            end = st.page_address(st.NUM_PAGES)
+            if self._has_range(0, st.HISTORY_ADDR):
+                self._refresh()
+                self._clear_range(end, st.EEPROM_SIZE - end)
+            self._read_range(0, st.HISTORY_ADDR)
+            hdr = self.buf[0:9]
+            self.image.model = hdr[2] * 256 + hdr[3]
+            self.image.station_id = struct.unpack('>I', bytes(hdr[5:9]))[0]
+            for page, (flag, _) in enumerate(self._get_pages()):
+                n = st.page_count(flag)
+                if n:
+                    self._read_range(st.page_address(page),
+                                     n * st.RECORD_SIZE)
+            self._read_range(end, st.EEPROM_SIZE - end)
+            self.chunks_skipped = (WH23xxImage.NUM_CHUNKS -
+                                   self.image.count_chunks())
+            self.image.ts = time.time()
+        finally:
+            self._close()
+        return {'chunks_read': self.chunks_read,
+                'chunks_skipped': self.chunks_skipped,
+                'pages_refreshed': self.pages_refreshed,
+                'retries': self.retries,
+                'elapsed': time.time() - t_start}
+
+    def _open(self):
+        # resume from an existing image, otherwise start a new one
+        size = WH23xxImage.IMAGE_OFFSET + WH23xxStation.EEPROM_SIZE
+        image = None
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rb') as f:
+                data = bytearray(f.read())
+            image = WH23xxImage.unpack(data)
+        if image is not None and len(data) == size:
+            loginf('resuming dump to %s: %s' % (self.filename, image))
+            self.buf = data[WH23xxImage.IMAGE_OFFSET:]
+        else:
+            image = WH23xxImage(ts=time.time())
+            self.buf = bytearray(b'\xff' * WH23xxStation.EEPROM_SIZE)
+            with open(self.filename, 'wb') as f:
+                f.write(image.pack())
+                f.write(self.buf)
+        self.image = image
+        self._f = open(self.filename, 'r+b')
+
+    def _close(self):
+        self._save_header()
+        self._f.close()
+
+    def _save_header(self):
+        self._f.seek(0)
+        self._f.write(self.image.pack())
+        self._f.flush()
+
+    def _refresh(self):
+        # the station may have logged since the image was started.  read the
+        # configuration, page flags, and page table again, and forget every
+        # history page whose flag or page table entry changed.  the pages
+        # are forgotten in the image header before the new page table goes
+        # into the image, so an interrupted refresh is not lost.
+        st = WH23xxStation
+        old_pages = self._get_pages()
+        chunks = self._get_chunks(0, st.HISTORY_ADDR)
+        for i in chunks:
+            self._fetch_chunk(i)
+        for page, entry in enumerate(self._get_pages()):
+            if entry != old_pages[page]:
+                addr = st.page_address(page)
+                self._clear_range(addr, st.page_address(page + 1) - addr)
+                self.pages_refreshed += 1
+        self._save_header()
+        for i in chunks:
+            self._write_chunk(i)
+
+    def _get_pages(self):
+        # the flag and page table entry of each history page in the buffer
+        st = WH23xxStation
+        size = st.PAGE_TABLE_ENTRY_SIZE
+        return [(self.buf[st.PAGE_FLAG_ADDR + i],
+                 bytes(self.buf[st.PAGE_TABLE_ADDR + i * size:
+                                st.PAGE_TABLE_ADDR + (i + 1) * size]))
+                for i in range(st.NUM_PAGES)]
+
+    @staticmethod
+    def _get_chunks(addr, size):
+        return range(addr // WH23xxImage.CHUNK_SIZE,
+                     (addr + size - 1) // WH23xxImage.CHUNK_SIZE + 1)
+
+    def _has_range(self, addr, size):
+        return all([self.image.has_chunk(i)
+                    for i in self._get_chunks(addr, size)])
+
+    def _clear_range(self, addr, size):
+        for i in self._get_chunks(addr, size):
+            self.image.clear_chunk(i)
+
+    def _read_range(self, addr, size):
+        for i in self._get_chunks(addr, size):
+            if not self.image.has_chunk(i):
+                self._read_chunk(i)
+
+    def _read_chunk(self, i):
+        self._fetch_chunk(i)
+        self._write_chunk(i)
+
+    def _fetch_chunk(self, i):
+        # read a chunk from the station into the buffer
+        addr = i * WH23xxImage.CHUNK_SIZE
+        size = min(WH23xxImage.CHUNK_SIZE, WH23xxStation.EEPROM_SIZE - addr)
+        for ntries in range(1, self.max_tries + 1):
+            try:
+                self.station._read_eeprom_into(addr, size, self.buf, addr)
+                break
+            except (usb.USBError, weewx.WeeWxIOError) as e:
+                logdbg("dump: failed attempt %d of %d at 0x%04x: %s" %
+                       (ntries, self.max_tries, addr, e))
+                if ntries >= self.max_tries:
+                    raise weewx.RetriesExceeded(
+                        "dump: read failed at 0x%04x: %s" % (addr, e))
+                self.retries += 1
+                time.sleep(self.backoff * 2 ** (ntries - 1))
+        self.chunks_read += 1
+
+    def _write_chunk(self, i):
+        # save a chunk from the buffer to the image
+        addr = i * WH23xxImage.CHUNK_SIZE
+        size = min(WH23xxImage.CHUNK_SIZE, WH23xxStation.EEPROM_SIZE - addr)
+        self._f.seek(WH23xxImage.IMAGE_OFFSET + addr)
+        self._f.write(bytes(self.buf[addr:addr + size]))
+        self.image.set_chunk(i)
+        if self.chunks_read % 64 == 0:
+            self._save_header()
+
+
+class WH23xxImageStation(WH23xxStation):
+    """A station that reads from an eeprom image instead of usb.
+
+    The image file is memory mapped, so each read copies only the bytes
+    that were asked for.  Everything that reads the eeprom works as it does
+    with a live station, including the station info, page flags, page
+    table, and history.  Reading a part of the eeprom that is not in the
+    image raises an error.
+    """
+
+    def __init__(self, filename):
+        super(WH23xxImageStation, self).__init__()
+        self.filename = filename
+        self.image = None
+        self._f = None
+        self._mm = None
+
+    def open(self):
+        import mmap
+        self._f = open(self.filename, 'rb')
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error) as e:
+            self.close()
+            raise weewx.WeeWxIOError('cannot map image: %s' % e)
+        self.image = WH23xxImage.unpack(self._mm[0:WH23xxImage.IMAGE_OFFSET])
+        if self.image is None or len(self._mm) < (
+                WH23xxImage.IMAGE_OFFSET + self.EEPROM_SIZE):
+            self.close()
+            raise weewx.WeeWxIOError('not an eeprom image')
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def read_eeprom(self, addr, size):
+        # the whole range in a single copy
+        buf = bytearray(size)
+        self._read_eeprom_into(addr, size, buf, 0)
+        return buf
+
+    def _read_eeprom_into(self, addr, size, buf, offset):
+        if addr < 0 or size <= 0 or addr + size > self.EEPROM_SIZE:
+            raise weewx.WeeWxIOError('read_eeprom: range 0x%04x+%s is '
+                                     'beyond end of memory' % (addr, size))
+        for i in range(addr // WH23xxImage.CHUNK_SIZE,
+                       (addr + size - 1) // WH23xxImage.CHUNK_SIZE + 1):
+            if not self.image.has_chunk(i):
+                raise weewx.WeeWxIOError('read_eeprom: 0x%04x+%s is not in '
+                                         'the image' % (addr, size))
+        start = WH23xxImage.IMAGE_OFFSET + addr
+        buf[offset:offset + size] = self._mm[start:start + size]
+
+    def get_record(self, addr):
+        # decode the single history record at addr
+        return self.decode_history_record(
+            self.read_eeprom(addr, self.RECORD_SIZE))
+
+    def get_current(self):
+        raise weewx.WeeWxIOError('read_record: not available from an image')
+
+    def _write(self, label, buf, timeout=None):
+        raise weewx.WeeWxIOError('%s: not available from an image' % label)
+
+    def _reset(self):
+        pass
+
+    @staticmethod
+    def find_images(path):
+        # the image files in a directory, or just the path if it is a file
+        if not os.path.isdir(path):
+            return [path]
+        names = []
+        for name in sorted(os.listdir(path)):
+            fn = os.path.join(path, name)
+            if os.path.isfile(fn) and WH23xxImage.read_header(fn) is not None:
+                names.append(fn)
+        return names
+
+
+def _import_image(filename):
+    # decode one image for WH23xxImporter.  this runs in a worker process,
+    # so it returns everything the writer needs, including any error.  an
+    # image that cannot be decoded must not stop the other images.
+    try:
+        with WH23xxImageStation(filename) as s:
+            info = s.get_station_info()
+            rows = []
+            for run, raw in s.get_history_runs():
+                rows.extend(_get_history_rows(info['id'], run, raw))
+            return filename, info, s.image.ts, rows, None
+    except Exception as e:
+        return filename, None, None, None, "%s: %s" % (type(e).__name__, e)
+
+
+def _get_history_rows(station_id, run, raw):
+    # the rows for WH23xxImporter from the records of a run.  decode them
+    # all at once if we can.
+    times = []
+    for _, n, ts, interval in run:
+        times.extend([(ts + i * interval, interval) for i in range(n)])
+    if numpy is not None:
+        data = WH23xxStation.decode_history_records(raw)
+        columns = [data[c].tolist() for c in WH23xxImporter.COLUMNS]
+        return [[station_id, ts, interval] + [col[i] for col in columns]
+                for i, (ts, interval) in enumerate(times)]
+    rows = []
+    size = WH23xxStation.RECORD_SIZE
+    for i, (ts, interval) in enumerate(times):
+        data = WH23xxStation.decode_history_record(raw[i * size:i * size + size])
+        rows.append([station_id, ts, interval] +
+                    [data.get(c) for c in WH23xxImporter.COLUMNS])
+    return rows
+
+
+class WH23xxImporter(object):
+    """Import eeprom images into an sqlite database.
+
+    Images are decoded in a pool of worker processes, one image per task.
+    The rows come back to this process, which is the only writer.  Rows are
+    inserted with executemany in batches, committing once per batch, and a
+    record that is already in the database for the same station id and
+    timestamp is ignored, so overlapping images can be imported in any
+    order.
+    """
+
+    COLUMNS = ['temperature_in', 'temperature_out', 'humidity_in',
+               'humidity_out', 'pressure', 'wind_dir', 'wind_speed',
+               'gust_speed', 'rain_total', 'rain_overflow', 'light', 'uv',
+               'uvi', 'no_sensors']
+
+    def __init__(self, dbfile, processes=None, batch_size=20000):
+        self.dbfile = dbfile
+        import multiprocessing
+        self.processes = processes or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+
+    def create_tables(self, conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS station ("
+                     "station_id TEXT PRIMARY KEY, model TEXT, "
+                     "version TEXT, interval INTEGER, timezone INTEGER, "
+                     "latitude INTEGER, longitude INTEGER, "
+                     "image TEXT, image_time REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS history ("
+                     "station_id TEXT NOT NULL, dateTime INTEGER NOT NULL, "
+                     "interval INTEGER, %s, "
+                     "PRIMARY KEY (station_id, dateTime))" %
+                     ', '.join(['%s REAL' % c for c in self.COLUMNS]))
+
+    def run(self, filenames):
+        import multiprocessing
+        import sqlite3
+        t_start = time.time()
+        conn = sqlite3.connect(self.dbfile)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables(conn)
+        conn.commit()
+        sql = "INSERT OR IGNORE INTO history VALUES (%s)" % ', '.join(
+            ['?'] * (3 + len(self.COLUMNS)))
+        stats = {'images': 0, 'failed': 0, 'rows': 0, 'inserted': 0}
+        batch = []
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            for fn, info, image_ts, rows, err in pool.imap_unordered(
+                    _import_image, filenames):
+                if err is not None:
+                    logerr("import %s failed: %s" % (fn, err))
+                    stats['failed'] += 1
+                    continue
+                stats['images'] += 1
+                conn.execute("INSERT OR REPLACE INTO station VALUES "
+                             "(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (info['id'], info['model'], info['version'],
+                              info['interval'], info['timezone'],
+                              info['latitude'], info['longitude'],
+                              fn, image_ts))
+                batch.extend(rows)
+                stats['rows'] += len(rows)
+                if len(batch) >= self.batch_size:
+                    stats['inserted'] += self._insert(conn, sql, batch)
+                    batch = []
+            stats['inserted'] += self._insert(conn, sql, batch)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            conn.close()
+        stats['elapsed'] = time.time() - t_start
+        return stats
+
+    @staticmethod
+    def _insert(conn, sql, rows):
+        # insert in a single transaction, returning the number of new rows
+        before = conn.total_changes
+        with conn:
+            conn.executemany(sql, rows)
+        return conn.total_changes - before
+
+
+class WH23xxSimulator(object):
+    """In-process stand-in for a WH23xx console on USB.
+
+    This implements the parts of the pyusb 0.4 device and device handle
+    interfaces, and of the pyusb 1.x device and endpoint interfaces, that
+    WH23xxStation uses, backed by a 64K eeprom image.  It
+    answers READ_RECORD with the current frame split into 64-byte packets,
+    and answers READ_EEPROM, READ_PARAM, TIME_SYNC and CLEAR_HISTORY.  Use it
+    in place of a real device like this:
+
+      station = WH23xxStation(dev=WH23xxSimulator())
+
+    Each transfer can be delayed by latency seconds, a read can be dropped
+    (returns nothing) with probability drop_rate, or fail with a 'No data
+    available' usb error with probability error_rate.  A wedged station
+    does not answer anything until it is reset.
+    """
+
+    # station info from a TP2700
+    DEFAULT_INFO = "55 aa 00 23 10 bc 7a 28 28 52 a2 01 02 f3 04 ff 53 a2 01 4a b2 00 00 00 01 2c 01 1b fb 00 00 00 00 03 04 00 00 00 00 00 00 00 00 c3 ff 00 00 64 64 64 00 64 00 ff ff ff 6b"
+    # current data from a TP2700
+    DEFAULT_FRAME = "01 02 8f 02 02 13 03 02 11 04 02 13 05 02 13 06 32 07 63 08 27 f0 09 27 b2 0a 00 5a 0b 00 2b 0c 00 3b 0e 00 00 00 00 10 00 00 00 75 11 00 00 00 a2 12 00 00 00 75 13 00 00 04 c5 14 00 00 04 c5 15 00 ff ff ff 16 ff ff 17 ff"
+
+    def __init__(self, eeprom=None, frames=None, latency=0.0, drop_rate=0.0,
+                 error_rate=0.0, seed=None, wedged=False):
+        if eeprom is None:
+            eeprom = bytearray([0xff] * WH23xxStation.EEPROM_SIZE)
+            info = [int(x, 16) for x in self.DEFAULT_INFO.split()]
+            eeprom[0:len(info)] = bytearray(info)
+        self.eeprom = bytearray(eeprom)
+        if len(self.eeprom) != WH23xxStation.EEPROM_SIZE:
+            raise ValueError("eeprom image must be %s bytes" %
+                             WH23xxStation.EEPROM_SIZE)
+        if frames is None:
+            frames = [[int(x, 16) for x in self.DEFAULT_FRAME.split()]]
+        self.frames = [bytearray(f) for f in frames]
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.wedged = wedged
+        self.param = 0x00 # FSK
+        self.clock_offset = 0
+        self.frame_idx = 0
+        self.pending = []
+        self.claimed = False
+        self.num_writes = 0
+        self.num_reads = 0
+        self.num_resets = 0
+
+    # the usb device interface
+
+    def open(self):
+        return self
+
+    # the usb device handle interface
+
+    def detachKernelDriver(self, iface):
+        pass
+
+    def claimInterface(self, iface):
+        self.claimed = True
+
+    def setAltInterface(self, iface):
+        pass
+
+    def releaseInterface(self):
+        self.claimed = False
+
+    def reset(self):
+        self.num_resets += 1
+        self.wedged = False
+        self.pending = []
+
+    def interruptWrite(self, endpoint, buf, timeout):
+        self._delay()
+        self.num_writes += 1
+        # every command flushes whatever reply was not read
+        self.pending = []
+        buf = list(buf)
+        if len(buf) < 3 or buf[0] != 0x02 or buf[1] != len(buf) - 2:
+            raise usb.USBError("simulator: bad command %s" % _fmt(buf))
+        cmd = buf[2:-1]
+        if self.wedged:
+            pass
+        elif _calc_checksum(cmd) != buf[-1]:
+            self._reply([WH23xxStation.CMD_RESULT, cmd[0], 0x00,
+                         WH23xxStation.RT_INVALID_CRC])
+        elif cmd[0] == WH23xxStation.READ_RECORD:
+            frame = self.frames[self.frame_idx % len(self.frames)]
+            self.frame_idx += 1
+            self._reply([WH23xxStation.READ_RECORD, len(frame)] + list(frame))
+        elif cmd[0] == WH23xxStation.READ_EEPROM:
+            addr = cmd[1] + cmd[2] * 256
+            size = cmd[3]
+            if not 0 < size <= WH23xxStation.MAX_READ_SIZE:
+                self._reply([WH23xxStation.CMD_RESULT, cmd[0], 0x00,
+                             WH23xxStation.RT_TOO_SIZE])
+            else:
+                data = [self.eeprom[(addr + i) % WH23xxStation.EEPROM_SIZE]
+                        for i in range(size)]
+                self._reply([WH23xxStation.READ_EEPROM, size] + data)
+        elif cmd[0] == WH23xxStation.READ_PARAM:
+            self._reply([WH23xxStation.READ_PARAM, 1, self.param])
+        elif cmd[0] == WH23xxStation.TIME_SYNC:
+            ts = time.mktime((2000 + cmd[1], cmd[2], cmd[3],
+                              cmd[4], cmd[5], cmd[6], 0, 0, -1))
+            self.clock_offset = int(ts - time.time())
+        elif cmd[0] == WH23xxStation.CLEAR_HISTORY:
+            self.clear_history()
+        elif cmd[0] == WH23xxStation.CLEAR_MAX_MIN_DAY:
+            pass
+        else:
+            self._reply([WH23xxStation.CMD_RESULT, cmd[0], 0x00,
+                         WH23xxStation.RT_UNKNOWN_CMD])
+        return len(buf)
+
+    # the pyusb 1.x usb.core device interface
+
+    def is_kernel_driver_active(self, iface):
+        return False
+
+    def detach_kernel_driver(self, iface):
+        pass
+
+    def set_configuration(self):
+        pass
+
+    def get_active_configuration(self):
+        return {(0, 0): [
+            WH23xxSimulator.Endpoint(self, WH23xxStation.USB_ENDPOINT_IN),
+            WH23xxSimulator.Endpoint(self, WH23xxStation.USB_ENDPOINT_OUT)]}
+
+    class Endpoint(object):
+        # a usb.core endpoint, in terms of the 0.4 interface
+        def __init__(self, sim, address):
+            self.sim = sim
+            self.bEndpointAddress = address
+
+        def write(self, data, timeout=None):
+            return self.sim.interruptWrite(self.bEndpointAddress, data,
+                                           timeout)
+
+        def read(self, size_or_buffer, timeout=None):
+            if isinstance(size_or_buffer, int):
+                return array.array('B', self.sim.interruptRead(
+                    self.bEndpointAddress, size_or_buffer, timeout))
+            pkt = self.sim.interruptRead(self.bEndpointAddress,
+                                         len(size_or_buffer), timeout)
+            size_or_buffer[0:len(pkt)] = array.array('B', pkt)
+            return len(pkt)
+
+    def interruptRead(self, endpoint, size, timeout):
+        self._delay()
+        self.num_reads += 1
+        if self.error_rate and self.rng.random() < self.error_rate:
+            raise usb.USBError("No data available")
+        if not self.pending:
+            raise usb.USBError("No data available")
+        pkt = self.pending.pop(0)
+        if self.drop_rate and self.rng.random() < self.drop_rate:
+            return ()
+        return pkt[:size]
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _reply(self, msg):
+        # append the checksum then split into usb packets, each of which
+        # starts with 0x01 and the number of payload bytes in the packet.
+        msg = msg + [_calc_checksum(msg)]
+        n = WH23xxStation.USB_PACKET_SIZE - 2
+        for i in range(0, len(msg), n):
+            chunk = msg[i:i + n]
+            pkt = [0x01, len(chunk)] + chunk + [0x00] * (n - len(chunk))
+            self.pending.append(tuple(pkt))
+
+    # manipulate the simulated station memory
+
+    def set_frames(self, frames):
+        self.frames = [bytearray(f) for f in frames]
+        self.frame_idx = 0
+
+    def clear_history(self):
+        start = WH23xxStation.PAGE_FLAG_ADDR
+        self.eeprom[start:WH23xxStation.EEPROM_SIZE] = bytearray(
+            [0xff] * (WH23xxStation.EEPROM_SIZE - start))
+
+    def add_history(self, record, ts, interval):
+        # log a record the way the station does: fill the current page, then
+        # start the next page, wrapping around to the first page.
+        flags = WH23xxStation.PAGE_FLAG_ADDR
+        page = None
+        latest = None
+        for p in range(WH23xxStation.NUM_PAGES):
+            count = WH23xxStation.page_count(self.eeprom[flags + p])
+            entry = self._get_page_entry(p)
+            if count and entry and (latest is None or entry[0] > latest):
+                page, latest = p, entry[0]
+        if page is not None:
+            count = self.eeprom[flags + page]
+            start, page_interval = self._get_page_entry(page)
+            if (count < WH23xxStation.RECORDS_PER_PAGE and
+                page_interval == interval and
+                ts == start + count * interval):
+                self._put_record(page, count, record)
+                self.eeprom[flags + page] = count + 1
+                return
+            page = (page + 1) % WH23xxStation.NUM_PAGES
+        else:
+            page = 0
+        self._put_page_entry(page, ts, interval)
+        self._put_record(page, 0, record)
+        self.eeprom[flags + page] = 1
+
+    def fill_history(self, count, start_ts=None, interval=300):
+        # log count synthetic records, ending now unless a start is given
+        if start_ts is None:
+            start_ts = int(time.time()) // interval * interval
+            start_ts -= (count - 1) * interval
+        for i in range(count):
+            self.add_history(self.make_record(i), start_ts + i * interval,
+                             interval)
+
+    def _get_page_entry(self, page):
+        addr = (WH23xxStation.PAGE_TABLE_ADDR +
+                page * WH23xxStation.PAGE_TABLE_ENTRY_SIZE)
+        return WH23xxStation.decode_page_timestamp(
+            self.eeprom[addr:addr + WH23xxStation.PAGE_TABLE_ENTRY_SIZE])
+
+    def _put_page_entry(self, page, ts, interval):
+        t = time.localtime(ts)
+        addr = (WH23xxStation.PAGE_TABLE_ADDR +
+                page * WH23xxStation.PAGE_TABLE_ENTRY_SIZE)
+        self.eeprom[addr:addr + WH23xxStation.PAGE_TABLE_ENTRY_SIZE] = \
+            bytearray([t.tm_year - 2000, t.tm_mon, t.tm_mday, t.tm_hour,
+                       t.tm_min, t.tm_sec, interval & 0xff, interval >> 8])
+
+    def _put_record(self, page, idx, record):
+        addr = (WH23xxStation.page_address(page) +
+                idx * WH23xxStation.RECORD_SIZE)
+        self.eeprom[addr:addr + WH23xxStation.RECORD_SIZE] = bytearray(record)
+
+    @staticmethod
+    def make_record(i):
+        # an 18-byte history record with values that vary with i
+        wind_dir = (i * 10) % 360
+        rain = i % 0x10000
+        temp_in = 250 + 400 + i % 50
+        temp_out = 100 + 400 + i % 100
+        pressure = 10130 + i % 40
+        light = (i * 1000) % 3000000
+        uv = (i * 100) % 8000
+        return [(wind_dir >> 8) & 0x01, wind_dir & 0xff, i % 200, i % 250,
+                rain & 0xff, rain >> 8, 40 + i % 20, 60 + i % 30,
+                temp_in & 0xff, ((temp_in >> 8) & 0x0f) + ((temp_out >> 4) & 0xf0),
+                temp_out & 0xff,
+                pressure >> 8, pressure & 0xff,
+                light & 0xff, (light >> 8) & 0xff, (light >> 16) & 0xff,
+                uv & 0xff, uv >> 8]
+
+
+class WH23xxBenchmark(object):
+    """Measure the throughput and latency of the driver i/o path.
+
+    The benchmark runs against a WH23xxSimulator with the specified latency
+    per usb transfer, so it needs no hardware.  For each operation it reports
+    operations/sec, bytes/sec, p50/p95/p99 latency in milliseconds, and
+    allocations per operation.  Allocations are the net number of objects
+    tracked by the garbage collector, which is what drives gc pressure in a
+    long-running weewxd.  The results are a dictionary that can be saved as
+    json to compare one driver version against another.
+    """
+
+    def __init__(self, count=1000, latency=0.0, history_bytes=0x1000,
+                 seed=None):
+        self.count = count
+        self.latency = latency
+        self.history_bytes = history_bytes
+        self.seed = seed
+
+    def run(self):
+        sim = WH23xxSimulator(latency=self.latency, seed=self.seed)
+        sim.fill_history(WH23xxStation.NUM_PAGES *
+                         WH23xxStation.RECORDS_PER_PAGE)
+        station = WH23xxStation(dev=sim)
+        driver = WH23xxDriver(station=station, poll_interval=0)
+        results = {
+            'driver_version': DRIVER_VERSION,
+            'python_version': sys.version.split()[0],
+            'usb_info': get_usb_info(),
+            'timestamp': int(time.time()),
+            'count': self.count,
+            'latency': self.latency,
+            'operations': dict(),
+            }
+        ops = results['operations']
+        frame_size = len(sim.frames[0])
+        ops['get_current'] = self.measure(
+            station.get_current, self.count, frame_size)
+        n = max(1, self.count // 10)
+        ops['read_eeprom'] = self.measure(
+            lambda: station.read_eeprom(WH23xxStation.HISTORY_ADDR,
+                                        self.history_bytes),
+            n, self.history_bytes)
+        packets = driver.genLoopPackets()
+        ops['loop_packet'] = self.measure(
+            lambda: next(packets), self.count, frame_size)
+        driver.closePort()
+        # the cost of a single write and read through each usb transport
+        size = WH23xxStation.MAX_READ_SIZE
+        buf = bytearray(size)
+        for transport in WH23xxStation.TRANSPORTS:
+            station = WH23xxStation(dev=sim, transport=transport.name)
+            station.open()
+            ops['transfer_%s' % transport.name] = self.measure(
+                lambda: station._read_eeprom_into(0, size, buf, 0),
+                self.count, size)
+            station.close()
+        return results
+
+    @staticmethod
+    def measure(func, count, nbytes):
+        # call func count times, timing each call.  disable the garbage
+        # collector so that the gc count is the number of objects created.
+        timer = WH23xxBenchmark.timer
+        latencies = []
+        gc.collect()
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            gc_start = gc.get_count()[0]
+            t_start = timer()
+            for _ in range(count):
+                t0 = timer()
+                func()
+                latencies.append(timer() - t0)
+            elapsed = timer() - t_start
+            gc_objects = gc.get_count()[0] - gc_start
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return WH23xxBenchmark.summarize(latencies, elapsed, nbytes,
+                                         gc_objects)
+
+    @staticmethod
+    def summarize(latencies, elapsed, nbytes, gc_objects):
+        n = len(latencies)
+        latencies = sorted(latencies)
+        def pct(p):
+            return 1000.0 * latencies[int(round(p / 100.0 * (n - 1)))]
+        return {
+            'count': n,
+            'elapsed': elapsed,
+            'ops_per_sec': n / elapsed if elapsed else None,
+            'bytes_per_sec': n * nbytes / elapsed if elapsed else None,
+            'p50_ms': pct(50),
+            'p95_ms': pct(95),
+            'p99_ms': pct(99),
+            'max_ms': 1000.0 * latencies[-1],
+            'allocs_per_op': float(gc_objects) / n,
+            }
+
+    timer = staticmethod(_perf_counter)
+
+
 # define a main entry point for basic testing of the station.  invoke this as
 # follows from the weewx root dir:
 #
@@ -973,10 +4120,9 @@ if __name__ == '__main__':
                        'mode', 'model', 'timezone', 'version']
 
     def print_info(x, display_keys=None):
-        keys = x.keys() if not display_keys else list(set(x.keys()) & set(display_keys))
-        keys.sort()
+        keys = sorted(x.keys() if not display_keys else set(x.keys()) & set(display_keys))
         for k in keys:
-            print "%s: %s" % (k, x[k])
+            print("%s: %s" % (k, x[k]))
 
     import optparse
 
@@ -990,70 +4136,271 @@ if __name__ == '__main__':
     parser.add_option('--debug', dest='debug', action='store_true',
                       help='display diagnostic information while running')
     parser.add_option('--action', dest='action', default='current',
-                      help='actions include: info, info-all, current, test-decode-info, test-decode-current, test-decode-history, dump')
+                      help='actions include: info, info-all, current, history, test-decode-info, test-decode-current, test-decode-history, test-decode-history-batch, bench-decode, bench-io, stats, capture, replay, dump, dump-image, decode-image, import-images')
+    parser.add_option('--since', dest='since', type=int, metavar='TS',
+                      help='only history records at or after this timestamp')
+    parser.add_option('--count', dest='count', type=int, default=10000,
+                      help='number of iterations for benchmarks and stats')
+    parser.add_option('--simulator', dest='simulator', action='store_true',
+                      help='use a simulated station instead of usb')
+    parser.add_option('--socket', dest='socket', metavar='PATH',
+                      help='read from the publisher on this socket')
+    parser.add_option('--image', dest='image', metavar='PATH',
+                      help='read from an eeprom image, or a directory of them')
+    parser.add_option('--processes', dest='processes', type=int,
+                      help='number of worker processes for import-images')
+    parser.add_option('--replay', dest='replay', metavar='FILE',
+                      help='replay the replies in this capture file')
+    parser.add_option('--speed', dest='speed', type=float, default=0.0,
+                      help='replay speed, or 0 for as fast as possible')
+    parser.add_option('--latency', dest='latency', type=float, default=0.0,
+                      help='seconds per usb transfer for bench-io')
+    parser.add_option('--output', dest='output', metavar='FILE',
+                      help='save the results to this file')
     (options, args) = parser.parse_args()
 
     if options.version:
-        print "driver version %s" % DRIVER_VERSION
+        print("driver version %s" % DRIVER_VERSION)
         exit(1)
 
     if options.debug:
         syslog.setlogmask(syslog.LOG_UPTO(syslog.LOG_DEBUG))
 
+    def get_station():
+        if options.image:
+            return WH23xxImageStation(options.image)
+        if options.replay:
+            return WH23xxReplayStation(options.replay, options.speed)
+        if options.socket:
+            return WH23xxClientStation(options.socket)
+        if options.simulator:
+            sim = WH23xxSimulator()
+            sim.fill_history(500)
+            return WH23xxStation(dev=sim)
+        return WH23xxStation()
+
     if options.action == 'info':
-        with WH23xxStation() as s:
+        with get_station() as s:
             print_info(s.get_station_info(), CORE_PARAMETERS)
     elif options.action == 'info-all':
-        with WH23xxStation() as s:
+        with get_station() as s:
             print_info(s.get_station_info())
     elif options.action == 'current':
-        with WH23xxStation() as s:
+        with get_station() as s:
             while True:
                 raw = s.get_current()
                 if options.debug:
-                    print _fmt(raw)
-                print WH23xxStation.decode_weather_data(raw)
+                    print(_fmt(raw))
+                print(WH23xxStation.decode_weather_data(raw))
                 time.sleep(5)
+    elif options.action == 'history':
+        with get_station() as s:
+            for ts, interval, data, _ in s.get_history(options.since):
+                print("%s (%s) %s" % (timestamp_to_string(ts), interval, data))
     elif options.action == 'sync-time':
-        with WH23xxStation() as s:
+        with get_station() as s:
             s.sync_time()
     elif options.action == 'clear-history':
-        with WH23xxStation() as s:
+        with get_station() as s:
             s.clear_history()
     elif options.action == 'test-decode-info':
         for row in INFO_DATA:
             raw = [int(x, 16) for x in row.split()]
-            print _fmt(raw)
-            print WH23xxStation.decode_station_info(raw)
+            print(_fmt(raw))
+            print(WH23xxStation.decode_station_info(raw))
     elif options.action == 'test-decode-current':
         for row in CURRENT_DATA:
             raw = [int(x, 16) for x in row.split()]
-            print _fmt(raw)
-            print WH23xxStation.decode_weather_data(raw)
+            print(_fmt(raw))
+            print(WH23xxStation.decode_weather_data(raw))
     elif options.action == 'test-decode-history':
         for row in HISTORY_DATA:
             raw = [int(x, 16) for x in row.split()]
-            print _fmt(raw)
-            print WH23xxStation.decode_history_record(raw)
+            print(_fmt(raw))
+            print(WH23xxStation.decode_history_record(raw))
+    elif options.action == 'test-decode-history-batch':
+        # verify that the batch decoder matches the record-by-record decoder
+        # for the sample data plus a set of random records.
+        rng = random.Random(2300)
+        raw = []
+        for row in HISTORY_DATA:
+            if row:
+                raw.extend([int(x, 16) for x in row.split()])
+        for i in range(3552):
+            raw.extend([rng.choice([rng.randint(0, 255), 0xff])
+                        for _ in range(18)])
+        batch = WH23xxStation.decode_history_records(raw)
+        errors = 0
+        for i in range(len(raw) // 18):
+            rec = WH23xxStation.decode_history_record(raw[i * 18:i * 18 + 18])
+            for k in rec:
+                x = batch[k][i]
+                if x is numpy.ma.masked:
+                    x = None
+                if x != rec[k]:
+                    errors += 1
+                    print("record %s %s: batch=%s scalar=%s" % (i, k, x, rec[k]))
+        print("compared %s records: %s mismatches" % (len(raw) // 18, errors))
+        if errors:
+            exit(1)
+    elif options.action == 'bench-decode':
+        # how fast the current data decode, as a dictionary and as a record
+        frames = [[int(x, 16) for x in row.split()] for row in CURRENT_DATA]
+        for name, func in [
+            ('compiled', WH23xxStation.decode_weather_data),
+            ('record', WH23xxStation.decode_weather_record)]:
+            t0 = time.time()
+            for _ in range(options.count):
+                for raw in frames:
+                    func(raw)
+            dt = time.time() - t0
+            n = options.count * len(frames)
+            print("%s: %d frames in %.3fs: %.0f frames/sec" % (
+                name, n, dt, n / dt if dt else 0))
+    elif options.action == 'bench-io':
+        # throughput and latency of the i/o path using a simulated station
+        results = WH23xxBenchmark(options.count, options.latency).run()
+        for name in sorted(results['operations']):
+            r = results['operations'][name]
+            print("%s: %.0f ops/sec %.0f bytes/sec p50=%.3fms p95=%.3fms"
+                   " p99=%.3fms allocs/op=%.1f" %
+                   (name, r['ops_per_sec'], r['bytes_per_sec'], r['p50_ms'],
+                    r['p95_ms'], r['p99_ms'], r['allocs_per_op']))
+        if options.output:
+            with open(options.output, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+    elif options.action == 'stats':
+        # poll through the driver, then show the time spent in each stage
+        driver = WH23xxDriver(station=get_station(), poll_interval=0)
+        try:
+            packets = driver.genLoopPackets()
+            for _ in range(options.count):
+                next(packets)
+            stats = driver.get_stats()
+        finally:
+            driver.closePort()
+        print("%-12s %8s %10s %10s %10s %10s" % (
+            'stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms'))
+        for stage in sorted(stats['stages']['timings']):
+            t = stats['stages']['timings'][stage]
+            print("%-12s %8d %10.3f %10.3f %10.3f %10.3f" % (
+                stage, t['count'], 1000.0 * t['sum'] / t['count'],
+                1000.0 * WH23xxStats.quantile(t, 0.50),
+                1000.0 * WH23xxStats.quantile(t, 0.95), 1000.0 * t['max']))
+        for name in ['retries', 'known_usb_err', 'checksum_mismatch']:
+            print("%s: %s" % (name, stats['stages']['counters'].get(name, 0)))
+        print("frames: %s (%s duplicate)" % (
+            stats['frames_read'], stats['frames_duplicate']))
+        if options.output:
+            with open(options.output, 'w') as f:
+                json.dump(stats, f, indent=2, sort_keys=True)
+    elif options.action == 'capture':
+        # record --count current data replies and the station info
+        if not options.output:
+            print("specify a capture file with --output")
+            exit(1)
+        with get_station() as s:
+            s.capture = WH23xxCapture(options.output)
+            try:
+                s.get_station_info()
+                for _ in range(options.count):
+                    s.get_current()
+                    time.sleep(5)
+            finally:
+                s.capture.close()
+    elif options.action == 'replay':
+        # feed a capture through the driver, as fast as possible by default
+        if not options.replay:
+            print("specify a capture file with --replay")
+            exit(1)
+        driver = WH23xxDriver(station=get_station(), poll_interval=0)
+        n = 0
+        t_start = _perf_counter()
+        try:
+            for packet in driver.genLoopPackets():
+                n += 1
+                if options.debug:
+                    print(packet)
+        except EOFError:
+            pass
+        finally:
+            driver.closePort()
+        elapsed = _perf_counter() - t_start
+        counters = driver.get_stats()['stages']['counters']
+        print("replayed %s frames, %s packets, %s decode failures in %.3fs" % (
+            counters.get('replayed', 0), n,
+            counters.get('decode_failed', 0), elapsed))
     elif options.action == 'eeprom-time':
-        with WH23xxStation() as s:
+        with get_station() as s:
             raw = s._read_eeprom(0x02c8, 8)
-            print _fmt(raw[0:8])
-            print "%04d.%02d.%02d %02d:%02d %ss" % (
+            print(_fmt(raw[0:8]))
+            print("%04d.%02d.%02d %02d:%02d %ss" % (
                 2000 + raw[0], raw[1], raw[2], raw[3], raw[4],
-                raw[5] + raw[6] * 256)
+                raw[5] + raw[6] * 256))
+    elif options.action == 'dump-image':
+        # dump the eeprom to an image file, resuming if it is incomplete
+        if not options.output:
+            print("specify an image file with --output")
+            exit(1)
+        with get_station() as s:
+            dumper = WH23xxDumper(s, options.output)
+            result = dumper.run()
+        print("%s: %s" % (options.output, dumper.image))
+        print("read %(chunks_read)s chunks, skipped %(chunks_skipped)s,"
+              " refreshed %(pages_refreshed)s pages,"
+              " %(retries)s retries in %(elapsed).1fs" % result)
+    elif options.action == 'decode-image':
+        # summarize each image, or show the history with --debug
+        if not options.image:
+            print("specify an image file or directory with --image")
+            exit(1)
+        t_start = _perf_counter()
+        nrec = 0
+        images = WH23xxImageStation.find_images(options.image)
+        for fn in images:
+            try:
+                with WH23xxImageStation(fn) as s:
+                    info = s.get_station_info()
+                    n = 0
+                    first = last = None
+                    for ts, interval, data, _ in s.get_history(options.since):
+                        if first is None:
+                            first = ts
+                        last = ts
+                        n += 1
+                        if options.debug:
+                            print("%s (%s) %s" % (
+                                timestamp_to_string(ts), interval, data))
+                    nrec += n
+                    print("%s: id=%s model=%s interval=%s records=%s %s %s" % (
+                        fn, info['id'], info['model'], info['interval'], n,
+                        timestamp_to_string(first), timestamp_to_string(last)))
+            except weewx.WeeWxIOError as e:
+                print("%s: %s" % (fn, e))
+        print("decoded %s records from %s images in %.3fs" % (
+            nrec, len(images), _perf_counter() - t_start))
+    elif options.action == 'import-images':
+        # import an image, or a directory of them, into an sqlite database
+        if not options.image or not options.output:
+            print("specify images with --image and a database with --output")
+            exit(1)
+        importer = WH23xxImporter(options.output, options.processes)
+        result = importer.run(WH23xxImageStation.find_images(options.image))
+        print("imported %(images)s images (%(failed)s failed), "
+               "%(inserted)s new of %(rows)s records in %(elapsed).1fs" %
+               result)
     elif options.action == 'dump':
-        with WH23xxStation() as s:
+        with get_station() as s:
             size = 0x20
             for i in range(0x0000, 0xffff, size):
                 for n in range(0, 3):
                     try:
                         raw = s._read_eeprom(i, 0x20)
-                        print "%04x" % i, _fmt(raw[:size])
+                        print("%04x" % i, _fmt(raw[:size]))
                         break
-                    except Exception, e:
-                        print "failed read %d of 3 for 0x%04x: %s" % (n+1, i, e)
-                        print "waiting 3 seconds before retry"
+                    except Exception as e:
+                        print("failed read %d of 3 for 0x%04x: %s" % (n+1, i, e))
+                        print("waiting 3 seconds before retry")
                         time.sleep(3)
                 else:
                     raise Exception("retries failed")
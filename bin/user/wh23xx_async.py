@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# Copyright 2016 Matthew Wall
+# Distributed under the terms of the GNU Public License (GPLv3)
+
+"""
+asyncio interface to Fine Offset WH23xx stations.  This requires python 3.7
+or later.
+
+AsyncWH23xxStation wraps a WH23xxStation so that it can be used from an
+event loop.  The usb transfers are blocking, so each one runs in an
+executor, but everything else, including waiting between retries, happens
+on the event loop.  Operations on a station are serialized, so a single
+station can be shared by many tasks, and many stations can share one loop.
+
+  import asyncio
+  from user.wh23xx_async import AsyncWH23xxStation
+
+  async def main():
+      async with AsyncWH23xxStation() as station:
+          print(await station.get_current())
+          async for ts, interval, data, _ in station.read_history(since):
+              print(ts, data)
+
+  asyncio.run(main())
+"""
+
+import asyncio
+import functools
+
+import usb
+
+import weewx
+from user.wh23xx import (WH23xxStation, known_usb_err,
+                         logdbg, loginf, logerr)
+
+
+class AsyncWH23xxStation(object):
+    """Awaitable operations on a WH23xxStation.
+
+    If no station is specified, one is created with the keyword arguments,
+    for example bus and address, or station_id.  Reads that fail are
+    retried up to max_tries times, waiting retry_wait seconds in between.
+    The usb transfers run in the executor, or the default executor of the
+    loop if none is specified.
+    """
+
+    def __init__(self, station=None, max_tries=5, retry_wait=1.0,
+                 executor=None, **station_kwargs):
+        self.station = station or WH23xxStation(**station_kwargs)
+        self.max_tries = max_tries
+        self.retry_wait = retry_wait
+        self._executor = executor
+        self._lock = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, _, value, traceback):
+        await self.close()
+
+    def _get_lock(self):
+        # create the lock on first use, so that it belongs to the loop that
+        # is running, not whatever loop existed when we were created.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args))
+
+    async def _call(self, label, func, *args):
+        # run a blocking station operation, one at a time, with retries
+        ntries = 0
+        while True:
+            try:
+                async with self._get_lock():
+                    return await self._run(func, *args)
+            except usb.USBError as e:
+                if known_usb_err(e):
+                    logdbg("%s: %s" % (label, e))
+                    self.station.stats.count('known_usb_err')
+                else:
+                    ntries += 1
+                    logerr("%s: failed attempt %d of %d: %s" %
+                           (label, ntries, self.max_tries, e))
+            except weewx.WeeWxIOError as e:
+                ntries += 1
+                logerr("%s: failed attempt %d of %d: %s" %
+                       (label, ntries, self.max_tries, e))
+            if ntries >= self.max_tries:
+                msg = "%s failed: max retries (%d) exceeded" % (
+                    label, self.max_tries)
+                logerr(msg)
+                self.station.stats.count('retries_exceeded')
+                raise weewx.RetriesExceeded(msg)
+            self.station.stats.count('retries')
+            await asyncio.sleep(self.retry_wait)
+
+    async def open(self):
+        async with self._get_lock():
+            await self._run(self.station.open)
+
+    async def close(self):
+        async with self._get_lock():
+            await self._run(self.station.close)
+
+    async def get_current(self):
+        # the raw current data, as for WH23xxStation.get_current
+        return await self._call('get_current', self.station.get_current)
+
+    async def get_weather_data(self):
+        # the decoded current data
+        raw = await self.get_current()
+        return WH23xxStation.decode_weather_record(raw) if raw else None
+
+    async def get_station_info(self):
+        return await self._call('get_station_info',
+                                self.station.get_station_info)
+
+    async def sync_time(self):
+        await self._call('sync_time', self.station.sync_time)
+
+    async def read_eeprom(self, addr, size):
+        # read one chunk at a time, so that other operations on the station
+        # can run in between the chunks of a big read.
+        if addr < 0 or addr + size > WH23xxStation.EEPROM_SIZE:
+            raise weewx.WeeWxIOError('read_eeprom: range 0x%04x+%s is '
+                                     'beyond end of memory' % (addr, size))
+        buf = bytearray(size)
+        for pos in range(0, size, WH23xxStation.MAX_READ_SIZE):
+            n = min(size - pos, WH23xxStation.MAX_READ_SIZE)
+            await self._call('read_eeprom', self.station._read_eeprom_into,
+                             addr + pos, n, buf, pos)
+        return buf
+
+    async def read_history(self, since_ts=None, cursor=None):
+        # yield (timestamp, interval, record, address) for each record at
+        # or after since_ts, as for WH23xxStation.get_history.  the records
+        # are read a page at a time, each with retries, and other operations
+        # on the station can run between pages.
+        segments = await self._call('read_history',
+                                    self.station.get_history_segments,
+                                    since_ts, cursor)
+        done = 0
+        for seg in segments:
+            size = seg[1] * WH23xxStation.RECORD_SIZE
+            raw = await self._call('read_history', self.station.read_eeprom,
+                                   seg[0], size)
+            for rec in WH23xxStation.decode_history_run([seg], raw):
+                done += 1
+                self.station.stats.set_gauge('history_records_done', done)
+                yield rec
+
+
+# define a main entry point for basic testing.  invoke this as follows from
+# the weewx root dir:
+#
+# PYTHONPATH=bin python3 bin/user/wh23xx_async.py
+
+if __name__ == '__main__':
+    import optparse
+    import syslog
+    import time
+    from user.wh23xx import WH23xxSimulator
+
+    usage = """%prog [options] [--debug] [--help]"""
+
+    syslog.openlog('wh23xx_async', syslog.LOG_PID | syslog.LOG_CONS)
+    syslog.setlogmask(syslog.LOG_UPTO(syslog.LOG_INFO))
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--debug', dest='debug', action='store_true',
+                      help='display diagnostic information while running')
+    parser.add_option('--simulator', dest='simulator', action='store_true',
+                      help='use a simulated station instead of usb')
+    parser.add_option('--count', dest='count', type=int, default=5,
+                      help='number of times to read the current data')
+    (options, args) = parser.parse_args()
+
+    if options.debug:
+        syslog.setlogmask(syslog.LOG_UPTO(syslog.LOG_DEBUG))
+
+    async def show_current(station, count):
+        for _ in range(count):
+            print(await station.get_weather_data())
+            await asyncio.sleep(1)
+
+    async def show_history(station):
+        n = 0
+        async for ts, interval, data, _ in station.read_history(
+                time.time() - 3600):
+            print("%s (%s) %s" % (ts, interval, data))
+            n += 1
+        print("%s history records" % n)
+
+    async def main():
+        station = None
+        if options.simulator:
+            sim = WH23xxSimulator()
+            sim.fill_history(100)
+            station = WH23xxStation(dev=sim)
+        async with AsyncWH23xxStation(station) as s:
+            loginf("station info: %s" % (await s.get_station_info())['id'])
+            await asyncio.gather(show_current(s, options.count),
+                                 show_history(s))
+
+    asyncio.run(main())
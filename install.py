@@ -10,10 +10,11 @@ def loader():
 class WH23xxInstaller(ExtensionInstaller):
     def __init__(self):
         super(WH23xxInstaller, self).__init__(
-            version="0.14",
+            version="0.15",
             name='wh23xx',
             description='Collect data from wh23xx weather stations',
             author="Matthew Wall",
             author_email="mwall@users.sourceforge.net",
-            files=[('bin/user', ['bin/user/wh23xx.py'])]
+            files=[('bin/user', ['bin/user/wh23xx.py',
+                                 'bin/user/wh23xx_async.py'])]
             )
@@ -0,0 +1,395 @@
+# Copyright 2016 Matthew Wall
+# Distributed under the terms of the GNU Public License (GPLv3)
+#
+# Tests for the driver, using the simulated station where a station is
+# needed.  Run these from the top of the extension, in an environment that
+# has weewx and pyusb:
+#
+#   python -m unittest discover tests
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'bin', 'user'))
+import wh23xx
+from wh23xx import (WH23xxStation, WH23xxSimulator, WH23xxDriver,
+                    WH23xxDumper, WH23xxImage, WH23xxImageStation,
+                    WH23xxReplayStation)
+
+# enough records to fill every page of the logger
+CAPACITY = WH23xxStation.NUM_PAGES * WH23xxStation.RECORDS_PER_PAGE
+
+# byte offsets and values that mark each field as invalid
+SENTINELS = [
+    {0: 0x01, 1: 0xff}, # wind_dir
+    {0: 0x02, 2: 0xff}, # wind_speed
+    {0: 0x04, 3: 0xff}, # gust_speed
+    {6: 0xff}, # humidity_in
+    {7: 0xff}, # humidity_out
+    {8: 0xff, 9: 0x0f}, # temperature_in
+    {9: 0xf0, 10: 0xff}, # temperature_out
+    {11: 0xff, 12: 0xff}, # pressure
+    {13: 0xff, 14: 0xff, 15: 0xff}, # light
+    {16: 0xff, 17: 0xff}] # uv
+
+
+def make_records(count, seed=2300):
+    # random records, some with every byte 0xff, some with one or more
+    # fields set to the invalid value
+    rng = random.Random(seed)
+    records = [[0xff] * 18, [0x00] * 18]
+    for _ in range(count):
+        rec = [rng.randint(0, 255) for _ in range(18)]
+        for sentinel in rng.sample(SENTINELS, rng.randint(0, 3)):
+            for i, x in sentinel.items():
+                rec[i] |= x
+        records.append(rec)
+    return records
+
+
+# a READ_RECORD frame from a station, and what it decodes to
+CURRENT_DATA = (
+    "01 02 8f 02 02 13 03 02 11 04 02 13 05 02 13 06 32 07 63 08 27 f0 09 27 "
+    "b2 0a 00 5a 0b 00 2b 0c 00 3b 0e 00 00 00 00 10 00 00 00 75 11 00 00 00 "
+    "a2 12 00 00 00 75 13 00 00 04 c5 14 00 00 04 c5 15 00 ff ff ff 16 ff ff "
+    "17 ff")
+CURRENT_VALUES = {
+    'in_temp': 25.5, 'out_temp': 13.1, 'dewpoint': 12.9, 'windchill': 13.1,
+    'heatindex': 13.1, 'in_humidity': 50, 'out_humidity': 99,
+    'abs_baro': 1022.4, 'rel_baro': 1016.2, 'wind_dir': 90,
+    'wind_speed': 4.3, 'gust_speed': 5.9, 'rain_rate': 0.0, 'rain_day': 11.7,
+    'rain_week': 16.2, 'rain_month': 11.7, 'rain_year': 122.1,
+    'rain_totals': 122.1, 'light': None, 'uv': None, 'uvi': None}
+
+
+class DecodeWeatherDataTest(unittest.TestCase):
+
+    def test_current_data(self):
+        data = WH23xxStation.decode_weather_data(
+            [int(x, 16) for x in CURRENT_DATA.split()])
+        self.assertEqual(sorted(data), sorted(CURRENT_VALUES))
+        for label, value in CURRENT_VALUES.items():
+            self.assertEqual(sorted(data[label]), ['value'])
+            if isinstance(value, float):
+                self.assertAlmostEqual(data[label]['value'], value, msg=label)
+            else:
+                self.assertEqual(data[label]['value'], value, label)
+
+    def test_date_and_time(self):
+        data = WH23xxStation.decode_weather_data(
+            [0xc1, 0x02, 0x8f, 0x10, 0x01, 0x02, 0x03, 0x04,
+             0x42, 0x02, 0x13, 0x05, 0x06])
+        self.assertEqual(data['in_temp'], {
+            'value': 25.5, 'date': '2016.01.02', 'time': '03:04'})
+        self.assertEqual(sorted(data['out_temp']), ['time', 'value'])
+        self.assertEqual(data['out_temp']['time'], '05:06')
+
+    def test_bad_frame(self):
+        # an unknown item, and an item without enough bytes
+        self.assertEqual(WH23xxStation.decode_weather_data([0x3f, 0x01]), {})
+        self.assertEqual(WH23xxStation.decode_weather_data([0x01, 0x02]), {})
+
+
+class DecodeHistoryRecordTest(unittest.TestCase):
+
+    def test_known_values(self):
+        # the simulator encodes records with the documented layout
+        for i in range(0, 500, 7):
+            data = WH23xxStation.decode_history_record(
+                WH23xxSimulator.make_record(i))
+            self.assertAlmostEqual(data['temperature_in'],
+                                   (250 + i % 50) / 10.0)
+            self.assertAlmostEqual(data['temperature_out'],
+                                   (100 + i % 100) / 10.0)
+            self.assertAlmostEqual(data['pressure'], (10130 + i % 40) / 10.0)
+            self.assertEqual(data['wind_dir'], (i * 10) % 360)
+            self.assertEqual(data['humidity_in'], 40 + i % 20)
+            self.assertEqual(data['humidity_out'], 60 + i % 30)
+            self.assertEqual(data['uv'], (i * 100) % 8000)
+
+    def test_invalid_values(self):
+        for sentinel in SENTINELS:
+            rec = [0] * 18
+            for i, x in sentinel.items():
+                rec[i] = x
+            data = WH23xxStation.decode_history_record(rec)
+            invalid = [k for k in data if data[k] is None]
+            # an invalid uv means the uv index is invalid too
+            self.assertTrue(len(invalid) in (1, 2), (sentinel, invalid))
+            if 'uv' in invalid:
+                self.assertEqual(sorted(invalid), ['uv', 'uvi'])
+
+
+@unittest.skipIf(wh23xx.numpy is None, "numpy is not installed")
+class DecodeHistoryRecordsTest(unittest.TestCase):
+
+    def test_matches_scalar_decoder(self):
+        records = make_records(5000)
+        raw = []
+        for rec in records:
+            raw.extend(rec)
+        batch = WH23xxStation.decode_history_records(raw)
+        for i, rec in enumerate(records):
+            data = WH23xxStation.decode_history_record(rec)
+            self.assertEqual(sorted(data), sorted(batch))
+            for k in data:
+                x = batch[k][i]
+                if x is wh23xx.numpy.ma.masked:
+                    x = None
+                if isinstance(data[k], float):
+                    self.assertAlmostEqual(x, data[k], msg="%s %s" % (i, k))
+                else:
+                    self.assertEqual(x, data[k], "%s %s" % (i, k))
+
+    def test_bytes_and_list_agree(self):
+        raw = []
+        for rec in make_records(100):
+            raw.extend(rec)
+        a = WH23xxStation.decode_history_records(raw)
+        b = WH23xxStation.decode_history_records(bytes(bytearray(raw)))
+        for k in a:
+            self.assertEqual(a[k].tolist(), b[k].tolist(), k)
+
+
+class HistoryTestCase(unittest.TestCase):
+    # a simulated station with history ending at self.now
+
+    interval = 60
+
+    def make_station(self, count):
+        self.now = int(time.time()) // self.interval * self.interval
+        self.count = count
+        self.sim = WH23xxSimulator()
+        self.sim.fill_history(
+            count, start_ts=self.now - (count - 1) * self.interval,
+            interval=self.interval)
+        return self.new_station()
+
+    def new_station(self):
+        station = WH23xxStation(dev=self.sim)
+        station.open()
+        return station
+
+    def log(self, n):
+        # the station logs n more records
+        for _ in range(n):
+            self.now += self.interval
+            self.sim.add_history(WH23xxSimulator.make_record(self.count),
+                                 self.now, self.interval)
+            self.count += 1
+
+    @staticmethod
+    def get_times(station, since_ts):
+        return [r[0] for r in station.get_history(since_ts)]
+
+
+class HistoryIndexTest(HistoryTestCase):
+
+    def test_wraparound_with_reused_station(self):
+        # the index is kept between reads, so it must notice pages that were
+        # started again, even those that filled up to the same count
+        station = self.make_station(CAPACITY + 500)
+        for n in [0, 1, 31, 32, 33, 100, 500, CAPACITY, CAPACITY + 40]:
+            since_ts = self.now
+            self.get_times(station, since_ts)
+            self.log(n)
+            times = self.get_times(station, since_ts)
+            self.assertEqual(times, self.get_times(self.new_station(),
+                                                   since_ts))
+            self.assertEqual(times[-1], self.now)
+            if n < CAPACITY - WH23xxStation.RECORDS_PER_PAGE:
+                self.assertEqual(len(times), n + 1, n)
+
+    def test_clear_history_with_reused_station(self):
+        station = self.make_station(1000)
+        self.assertEqual(len(self.get_times(station, None)), 1000)
+        self.sim.clear_history()
+        self.log(5)
+        self.assertEqual(len(self.get_times(station, None)), 5)
+
+
+class HistoryCursorTest(HistoryTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cursor_file = os.path.join(self.tmpdir, 'wh23xx-history.cursor')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def new_driver(self):
+        return WH23xxDriver(station=self.new_station(),
+                            history_cursor=self.cursor_file)
+
+    def get_new_times(self, driver, since_ts):
+        return [p['dateTime'] for p in driver.genArchiveRecords(since_ts)]
+
+    def test_resume_across_wraparound(self):
+        # resume with the same driver, and with a new one as after a
+        # restart, with more records each time than the cursor can follow
+        self.make_station(CAPACITY + 200)
+        driver = self.new_driver()
+        self.assertEqual(len(self.get_new_times(
+            driver, self.now - 50 * self.interval)), 50)
+        for n in [1, 40, 399, 1000, CAPACITY // 2]:
+            for d in [driver, self.new_driver()]:
+                since_ts = self.now
+                self.log(n)
+                self.assertEqual(self.get_new_times(d, since_ts), list(
+                    range(since_ts + self.interval, self.now + 1,
+                          self.interval)), n)
+                self.assertEqual(self.get_new_times(d, self.now), [])
+
+    def test_resume_after_clear_history(self):
+        self.make_station(1000)
+        driver = self.new_driver()
+        since_ts = self.now - 10 * self.interval
+        self.assertEqual(len(self.get_new_times(driver, since_ts)), 10)
+        self.sim.clear_history()
+        self.log(5)
+        since_ts = self.now - 5 * self.interval
+        for d in [driver, self.new_driver()]:
+            self.assertEqual(self.get_new_times(d, since_ts), list(
+                range(since_ts + self.interval, self.now + 1,
+                      self.interval)))
+
+
+class ImageDumpTest(HistoryTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'station.img')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def dump(self, station, max_chunks=None):
+        # dump to the image, stopping after max_chunks reads if specified
+        dumper = WH23xxDumper(station, self.filename, backoff=0)
+        if max_chunks is not None:
+            read_chunk = dumper._read_chunk
+            count = [0]
+            def stop_after(i):
+                count[0] += 1
+                if count[0] > max_chunks:
+                    raise KeyboardInterrupt
+                read_chunk(i)
+            dumper._read_chunk = stop_after
+        try:
+            return dumper.run()
+        except KeyboardInterrupt:
+            return None
+
+    def assert_image_matches(self):
+        # every chunk in the image matches the station, and the image has
+        # the same history as the station
+        with open(self.filename, 'rb') as f:
+            data = bytearray(f.read())
+        image = WH23xxImage.unpack(data)
+        eeprom = data[WH23xxImage.IMAGE_OFFSET:]
+        size = WH23xxImage.CHUNK_SIZE
+        for i in range(WH23xxImage.NUM_CHUNKS):
+            if image.has_chunk(i):
+                self.assertEqual(eeprom[i * size:(i + 1) * size],
+                                 self.sim.eeprom[i * size:(i + 1) * size], i)
+        station = WH23xxImageStation(self.filename)
+        station.open()
+        try:
+            self.assertEqual(list(station.get_history()),
+                             list(self.new_station().get_history()))
+        finally:
+            station.close()
+
+    def test_resume_interrupted_dump(self):
+        station = self.make_station(500)
+        self.assertEqual(self.dump(station, max_chunks=100), None)
+        result = self.dump(station)
+        self.assertTrue(0 < result['chunks_read'] < 200, result)
+        self.assert_image_matches()
+
+    def test_resume_after_logging(self):
+        # pages that changed since the dump are read again, and the rest
+        # are not
+        station = self.make_station(CAPACITY + 100)
+        full = self.dump(station)
+        result = self.dump(station)
+        self.assertEqual(result['pages_refreshed'], 0)
+        self.assertTrue(result['chunks_read'] < full['chunks_read'] // 10)
+        self.log(40)
+        result = self.dump(station)
+        self.assertEqual(result['pages_refreshed'], 2)
+        self.assert_image_matches()
+        self.log(40)
+        self.assertEqual(self.dump(station, max_chunks=5), None)
+        self.dump(station)
+        self.assert_image_matches()
+
+
+class CaptureReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def make_frames(n):
+        # frames with a different wind speed each time
+        frame = [int(x, 16) for x in WH23xxSimulator.DEFAULT_FRAME.split()]
+        frames = []
+        for i in range(n):
+            frame = list(frame)
+            frame[30] = i
+            frames.append(frame)
+        return frames
+
+    @staticmethod
+    def get_packets(driver, n=None):
+        # the loop packets without the time, until n packets or the end of
+        # a replay
+        packets = []
+        try:
+            for packet in driver.genLoopPackets():
+                del packet['dateTime']
+                packets.append(packet)
+                if len(packets) == n:
+                    break
+        except EOFError:
+            pass
+        return packets
+
+    def round_trip(self, filename):
+        sim = WH23xxSimulator(frames=self.make_frames(10))
+        driver = WH23xxDriver(station=WH23xxStation(dev=sim),
+                              poll_interval=0, capture_file=filename)
+        try:
+            info = driver._station.get_station_info()
+            packets = self.get_packets(driver, 10)
+        finally:
+            driver.closePort()
+        self.assertEqual([p['windSpeed'] for p in packets],
+                         [i / 10.0 for i in range(10)])
+        station = WH23xxReplayStation(filename, 0)
+        driver = WH23xxDriver(station=station, poll_interval=0)
+        try:
+            self.assertEqual(station.get_station_info(), info)
+            self.assertEqual(self.get_packets(driver), packets)
+        finally:
+            driver.closePort()
+
+    def test_round_trip(self):
+        self.round_trip(os.path.join(self.tmpdir, 'station.cap'))
+
+    def test_round_trip_compressed(self):
+        self.round_trip(os.path.join(self.tmpdir, 'station.cap.gz'))
+
+
+if __name__ == '__main__':
+    unittest.main()